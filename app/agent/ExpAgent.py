@@ -1,80 +1,380 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import NamedTuple, Optional
+import numpy as np
 from google import genai
 from pinecone import Pinecone
 from app.core.config import settings
+from app.utils.cache import TTLCache
+from app.utils.sse import sse_event, sse_token
+from app.utils.streaming import aiter_in_thread
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "get_embedding",
+    "get_embeddings_batch",
+    "upsert_check",
+    "upsert_checks_bulk",
+    "MatchRec",
+    "retrieve_checks",
+    "rerank_local",
+    "stream_expert_answer",
+    "warm_up_expert_agent",
+]
 
 # Initialize Pinecone
 pc = Pinecone(api_key=settings.PINECONE_API_KEY)
 index = pc.Index("lifehealth")
 
+# The Pinecone and Gemini SDKs are synchronous; run their calls on a bounded
+# pool so they never block the event loop serving concurrent SSE streams.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="expert-agent")
+
+async def _run_blocking(fn, *args, **kwargs):
+    """Run a blocking SDK call on the expert-agent thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
 # Configure Gemini client
 client = None
 if settings.GOOGLE_API_KEY:
     client = genai.Client(api_key=settings.GOOGLE_API_KEY)
 
+EMBED_MODEL = "llama-text-embed-v2"
+
+# Persistent embedding cache: sha256(model|input_type|text) -> float32 bytes.
+# Shared by the upsert and query paths and survives restarts; the model is part
+# of the key so switching embedding models never serves stale vectors.
+_embed_db = None
+_embed_db_lock = threading.Lock()
+
+def _embed_key(text: str, input_type: str) -> bytes:
+    return hashlib.sha256(f"{EMBED_MODEL}|{input_type}|{text}".encode("utf-8")).digest()
+
+def _embed_db_conn() -> sqlite3.Connection:
+    global _embed_db
+    if _embed_db is None:
+        _embed_db = sqlite3.connect(settings.EMBED_CACHE_PATH, check_same_thread=False)
+        _embed_db.execute(
+            "CREATE TABLE IF NOT EXISTS embed_cache "
+            "(hash BLOB PRIMARY KEY, vec BLOB NOT NULL, model TEXT, input_type TEXT)"
+        )
+        _embed_db.execute(
+            "CREATE TABLE IF NOT EXISTS check_quant "
+            "(check_id TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+    return _embed_db
+
+# Keys per SELECT ... IN (...), well under SQLite's bound-variable limit
+EMBED_DB_CHUNK = 500
+
+def _disk_cache_get(keys: list[bytes]) -> dict[bytes, list[float]]:
+    """Fetch cached vectors for the given keys; missing keys are absent from the result."""
+    try:
+        rows = []
+        with _embed_db_lock:
+            conn = _embed_db_conn()
+            for start in range(0, len(keys), EMBED_DB_CHUNK):
+                chunk = keys[start:start + EMBED_DB_CHUNK]
+                rows.extend(conn.execute(
+                    f"SELECT hash, vec FROM embed_cache WHERE hash IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        return {h: np.frombuffer(v, dtype=np.float32).tolist() for h, v in rows}
+    except Exception as e:
+        logger.warning(f"Embedding disk cache read failed: {e}")
+        return {}
+
+def _disk_cache_put(entries: list[tuple[bytes, list[float]]], input_type: str) -> None:
+    try:
+        with _embed_db_lock:
+            conn = _embed_db_conn()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embed_cache (hash, vec, model, input_type) VALUES (?, ?, ?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes(), EMBED_MODEL, input_type) for k, v in entries]
+            )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Embedding disk cache write failed: {e}")
+
+# Query embedding cache stats (logged every EMBED_CACHE_LOG_EVERY lookups)
+EMBED_CACHE_LOG_EVERY = 500
+_embed_lookups = 0
+
+@lru_cache(maxsize=2048)
+def _cached_embedding(text: str, input_type: str) -> tuple:
+    """
+    Embed a (stripped) text via Pinecone Inference and memoize the vector.
+    Falls back to the persistent cache before calling Pinecone.
+    Raises on failure so errors are never cached.
+    """
+    key = _embed_key(text, input_type)
+    cached = _disk_cache_get([key])
+    if key in cached:
+        return tuple(cached[key])
+
+    embedding_response = pc.inference.embed(
+        model=EMBED_MODEL,
+        inputs=[text],
+        parameters={
+            "input_type": input_type, 
+            "truncate": "END"
+        }
+    )
+    values = embedding_response[0]['values']
+    _disk_cache_put([(key, values)], input_type)
+    return tuple(values)
+
 def get_embedding(text: str, input_type: str = "passage") -> list[float]:
     """
     Generate embedding using Pinecone Inference (to match index model).
     Model: llama-text-embed-v2 (1024 dimensions)
+    Repeated texts are served from an in-memory LRU keyed by
+    (stripped text, input_type), backed by the persistent cache. Case is kept:
+    clinical terms like "ALL" and "all" must not share a vector.
     """
+    global _embed_lookups
     try:
         # Check if text is empty
         if not text or not text.strip():
             return []
-            
-        embedding_response = pc.inference.embed(
-            model="llama-text-embed-v2",
-            inputs=[text],
-            parameters={
-                "input_type": input_type, 
-                "truncate": "END"
-            }
-        )
-        return embedding_response[0]['values']
+
+        embedding = _cached_embedding(text.strip(), input_type)
+
+        _embed_lookups += 1
+        if _embed_lookups % EMBED_CACHE_LOG_EVERY == 0:
+            info = _cached_embedding.cache_info()
+            logger.info(f"Embedding cache: hits={info.hits}, misses={info.misses}, size={info.currsize}")
+
+        return list(embedding)
     except Exception as e:
         print(f"Embedding Error: {e}")
         return []
 
-async def upsert_check(
-    check_id: str,
+# Pinecone Inference caps the number of inputs per embed request
+EMBED_BATCH_SIZE = 96
+
+def get_embeddings_batch(texts: list[str], input_type: str = "passage") -> list[list[float]]:
+    """
+    Generate embeddings for many texts using Pinecone Inference.
+    Texts already in the persistent cache are not re-embedded; the rest are
+    sent in chunks of EMBED_BATCH_SIZE so bulk ingestion costs one
+    round-trip per chunk instead of one per text.
+    Returns an empty list on failure.
+    """
+    try:
+        if not texts:
+            return []
+
+        keys = [_embed_key(text, input_type) for text in texts]
+        found = _disk_cache_get(list(set(keys)))
+        # First occurrence of each uncached text (duplicates are embedded once)
+        missing = []
+        seen = set()
+        for i, key in enumerate(keys):
+            if key not in found and key not in seen:
+                seen.add(key)
+                missing.append(i)
+
+        new_entries = []
+        for start in range(0, len(missing), EMBED_BATCH_SIZE):
+            batch = missing[start:start + EMBED_BATCH_SIZE]
+            embedding_response = pc.inference.embed(
+                model=EMBED_MODEL,
+                inputs=[texts[i] for i in batch],
+                parameters={
+                    "input_type": input_type,
+                    "truncate": "END"
+                }
+            )
+            for i, r in zip(batch, embedding_response):
+                found[keys[i]] = r['values']
+                new_entries.append((keys[i], r['values']))
+
+        if new_entries:
+            _disk_cache_put(new_entries, input_type)
+        return [found[key] for key in keys]
+    except Exception:
+        logger.exception("Batch embedding failed")
+        return []
+
+# Local NormInt8 copies of stored check embeddings (check_id -> int8 bytes), kept in
+# the embedding cache database. rerank_local scores candidates against them on-box; it is
+# not applied to retrieve_checks, whose Pinecone matches are already exact top_k.
+def _quant_store_get(ids: list[str]) -> dict[str, bytes]:
+    try:
+        rows = []
+        with _embed_db_lock:
+            conn = _embed_db_conn()
+            for start in range(0, len(ids), EMBED_DB_CHUNK):
+                chunk = ids[start:start + EMBED_DB_CHUNK]
+                rows.extend(conn.execute(
+                    f"SELECT check_id, vec FROM check_quant WHERE check_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        return dict(rows)
+    except Exception as e:
+        logger.warning(f"Quantized check store read failed: {e}")
+        return {}
+
+def _quant_store_put(entries: list[tuple[str, bytes]]) -> None:
+    try:
+        with _embed_db_lock:
+            conn = _embed_db_conn()
+            conn.executemany("INSERT OR REPLACE INTO check_quant (check_id, vec) VALUES (?, ?)", entries)
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Quantized check store write failed: {e}")
+
+def quantize_norm_int8(embedding: list[float]) -> np.ndarray:
+    """L2-normalize an embedding and quantize it to int8 (4x smaller than float32)."""
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    if norm:
+        vec = vec / norm
+    return np.clip(np.round(vec * 127), -128, 127).astype(np.int8)
+
+def rerank_local(query_embedding: list[float], ids: list[str]) -> list[str]:
+    """
+    Re-order candidate check ids by int8 dot product against the query.
+    Ids without a stored quantized copy keep their original order at the end.
+    """
+    stored_vecs = _quant_store_get(list(dict.fromkeys(ids)))
+    known = [i for i in ids if i in stored_vecs]
+    unknown = [i for i in ids if i not in stored_vecs]
+    if not known:
+        return list(ids)
+
+    q = quantize_norm_int8(query_embedding).astype(np.int32)
+    stored = np.stack([np.frombuffer(stored_vecs[i], dtype=np.int8) for i in known]).astype(np.int32)
+    order = np.argsort(-(stored @ q), kind="stable")
+    return [known[k] for k in order] + unknown
+
+def _split_csv(value: str) -> list[str]:
+    """Split a comma-separated medication/lab string into trimmed, non-empty items."""
+    if not value:
+        return []
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+def _build_check_content(
     check_text: str,
     category: str,
     hospital_id: str,
     medication: str = None,
     lab_test: str = None
-):
+) -> str:
+    """Construct the rich context string that gets embedded for a check."""
+    content_to_embed = f"{check_text} [Category: {category}]"
+
+    # If hospital-specific data is present (medication/labs), include them in the embedding context
+    if hospital_id:
+         if medication:
+             content_to_embed += f" [Medication: {medication}]"
+         if lab_test:
+             content_to_embed += f" [Lab Test: {lab_test}]"
+
+    return content_to_embed
+
+async def upsert_checks_bulk(items: list[dict]):
     """
-    Embed and store a check/insight in Pinecone with metadata.
+    Embed and store many checks/insights in Pinecone with a single embed
+    pass and a single upsert.
+
+    Each item is a dict with keys: check_id, check_text, category,
+    hospital_id and optionally medication, lab_test.
     """
     try:
-        # Construct rich context for embedding
-        content_to_embed = f"{check_text} [Category: {category}]"
-        
-        # If hospital-specific data is present (medication/labs), include them in the embedding context
-        if hospital_id:
-             if medication:
-                 content_to_embed += f" [Medication: {medication}]"
-             if lab_test:
-                 content_to_embed += f" [Lab Test: {lab_test}]"
-        
+        items = [item for item in items if item.get("check_text", "").strip()]
+        if not items:
+            return {"status": "error", "message": "Failed to generate embedding."}
+
+        contents = [
+            _build_check_content(
+                item["check_text"],
+                item["category"],
+                item["hospital_id"],
+                item.get("medication"),
+                item.get("lab_test")
+            )
+            for item in items
+        ]
+
         # input_type="passage" for storing docs
-        embedding = get_embedding(content_to_embed, input_type="passage")
-        
-        if not embedding:
+        embeddings = await _run_blocking(get_embeddings_batch, contents, input_type="passage")
+
+        if len(embeddings) != len(items):
             return {"status": "error", "message": "Failed to generate embedding."}
 
-        metadata = {
-            "check_text": check_text,
-            "category": category,
-            "hospital_id": hospital_id,
-            "medication": medication or "",
-            "lab_test": lab_test or ""
-        }
-        
-        index.upsert(vectors=[(check_id, embedding, metadata)])
-        return {"status": "success", "message": f"Check {check_id} upserted."}
+        vectors = []
+        quantized = []
+        for item, embedding in zip(items, embeddings):
+            metadata = {
+                "check_text": item["check_text"],
+                "category": item["category"],
+                "hospital_id": item["hospital_id"],
+                "medication": item.get("medication") or "",
+                "lab_test": item.get("lab_test") or "",
+                # Pre-split lists so readers don't re-parse the strings per query
+                "medication_list": _split_csv(item.get("medication")),
+                "lab_test_list": _split_csv(item.get("lab_test"))
+            }
+            vectors.append((item["check_id"], embedding, metadata))
+            quantized.append((item["check_id"], quantize_norm_int8(embedding).tobytes()))
+
+        await _run_blocking(index.upsert, vectors=vectors)
+        await _run_blocking(_quant_store_put, quantized)
+        # New knowledge may change answers; drop replayable cached answers
+        _answer_cache.clear()
+
+        if len(vectors) == 1:
+            return {"status": "success", "message": f"Check {vectors[0][0]} upserted."}
+        return {"status": "success", "message": f"{len(vectors)} checks upserted."}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+async def upsert_check(
+    check_id: str,
+    check_text: str,
+    category: str,
+    hospital_id: str,
+    medication: str = None,
+    lab_test: str = None
+):
+    """
+    Embed and store a check/insight in Pinecone with metadata.
+    Routes through the batch path with a single item.
+    """
+    return await upsert_checks_bulk([{
+        "check_id": check_id,
+        "check_text": check_text,
+        "category": category,
+        "hospital_id": hospital_id,
+        "medication": medication,
+        "lab_test": lab_test
+    }])
+
+class MatchRec(NamedTuple):
+    """A single retrieved check, with privacy rules already applied."""
+    score: float
+    check_text: str
+    id: str
+    medication: str
+    lab_test: str
+    medication_list: Optional[list]  # None for vectors stored before list fields existed
+    lab_test_list: Optional[list]
+    source: str
+    hospital_id: str
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
 async def retrieve_checks(
     query: str,
     hospital_id: str,
@@ -97,7 +397,7 @@ async def retrieve_checks(
     """
     try:
         # input_type="query" for search queries
-        query_embedding = get_embedding(query, input_type="query")
+        query_embedding = await _run_blocking(get_embedding, query, input_type="query")
         
         if not query_embedding:
             return []
@@ -107,79 +407,132 @@ async def retrieve_checks(
         if category:
             filter_primary["category"] = category
             
-        results_primary = index.query(
+        results_primary = await _run_blocking(
+            index.query,
             vector=query_embedding,
             top_k=top_k,
             include_metadata=True,
             filter=filter_primary
         )
+        primary_matches = results_primary.get('matches', [])
+
+        # 2. Secondary Search: Different Hospital (NOT strict)
+        # Only issued when the primary under-fills top_k, so a filled primary costs one read
+        results_secondary = {}
+        needs_secondary = not strict_hospital and len(primary_matches) < top_k
+        if needs_secondary:
+            # Filter specifically excludes target hospital
+            filter_secondary = {"hospital_id": {"$ne": hospital_id}}
+            if category:
+                filter_secondary["category"] = category
+
+            results_secondary = await _run_blocking(
+                index.query,
+                vector=query_embedding,
+                top_k=max(1, top_k - len(primary_matches)), # Pinecone requires top_k >= 1
+                include_metadata=True,
+                filter=filter_secondary
+            )
         
         matches = []
         seen_ids = set()
         
-        def process_match(match, source_label):
-            metadata = match['metadata']
-            match_hospital_id = metadata.get('hospital_id')
-            
-            # PRIVACY CHECK: Only show sensitive data if it belongs to the user's hospital
-            is_own_hospital = (match_hospital_id == user_hospital_id)
+        def process_match(match, source_label, is_own_hospital):
+            meta = match['metadata']
             
-            meds = metadata.get('medication', '')
-            labs = metadata.get('lab_test', '')
+            # PRIVACY CHECK (is_own_hospital): Only show sensitive data if it belongs to the user's hospital
+            meds = meta.get('medication') or ''
+            labs = meta.get('lab_test') or ''
+            # None for vectors stored before the list fields existed
+            meds_list = meta.get('medication_list')
+            labs_list = meta.get('lab_test_list')
             
             if not is_own_hospital:
                 meds = "Restricted (Different Hospital)"
                 labs = "Restricted (Different Hospital)"
+                meds_list = []
+                labs_list = []
                 if source_label != "Same Hospital":
                      source_label = "Global Experience" # Generic label for others
             
-            return {
-                "score": match['score'],
-                "check_text": metadata.get('check_text'),
-                "id": match['id'],
-                "medication": meds,
-                "lab_test": labs,
-                "source": source_label,
-                "hospital_id": match_hospital_id
-            }
+            return MatchRec(
+                score=match['score'],
+                check_text=meta.get('check_text'),
+                id=match['id'],
+                medication=meds,
+                lab_test=labs,
+                medication_list=meds_list,
+                lab_test_list=labs_list,
+                source=source_label,
+                hospital_id=meta.get('hospital_id')
+            )
 
         # Process Primary Results
-        for match in results_primary.get('matches', []):
-            # For primary search, match_hospital_id SHOULD be hospital_id.
-            # Label depends on whether target == user
-            label = "Same Hospital" if hospital_id == user_hospital_id else "Targeted Hospital"
-            processed = process_match(match, label)
+        # For primary search, match_hospital_id SHOULD be hospital_id.
+        # Label depends on whether target == user
+        primary_is_own = hospital_id == user_hospital_id
+        primary_label = "Same Hospital" if primary_is_own else "Targeted Hospital"
+        for match in primary_matches:
+            processed = process_match(match, primary_label, primary_is_own)
             matches.append(processed)
             seen_ids.add(match['id'])
+
+        if not needs_secondary:
+            return matches
             
-        # 2. Secondary Search: Different Hospital (If needed and NOT strict)
-        if not strict_hospital and len(matches) < top_k:
-            remaining_k = top_k - len(matches)
-            
-            # Filter specifically excludes target hospital
-            filter_secondary = {"hospital_id": {"$ne": hospital_id}}
-            if category:
-                filter_secondary["category"] = category
-                
-            results_secondary = index.query(
-                vector=query_embedding,
-                top_k=remaining_k, # Fetch just enough to fill
-                include_metadata=True,
-                filter=filter_secondary
-            )
-            
-            # Process Secondary Results
-            for match in results_secondary.get('matches', []):
-                if match['id'] not in seen_ids:
-                    processed = process_match(match, "Global Experience")
-                    matches.append(processed)
+        # Process Secondary Results (only as many as needed to fill top_k)
+        remaining_k = max(1, top_k - len(matches))
+        fresh = [m for m in results_secondary.get('matches', []) if m['id'] not in seen_ids]
+        # Global matches can still be the user's own hospital when the target differs from it
+        matches.extend(
+            process_match(match, "Global Experience", match['metadata'].get('hospital_id') == user_hospital_id)
+            for match in fresh[:remaining_k]
+        )
             
         return matches
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-import json
+# Token frames are flushed once this many characters are buffered or this much time has passed
+SSE_FLUSH_CHARS = 64
+SSE_FLUSH_SECONDS = 0.05
+
+# Answer cache: a repeat of the same query (exact after whitespace/case normalization)
+# within the same hospital/privacy scope replays the last completed answer. Matching is
+# deliberately not semantic: queries that differ only by a negation or a dose must not
+# share an answer.
+ANSWER_CACHE_SIZE = 256
+ANSWER_CACHE_TTL = 600  # seconds
+_answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+# Gemini models whose HTTP connection has already been warmed in this process
+_warmed_models: set[str] = set()
+
+def _warm_gemini_connection(model_name: str) -> None:
+    """
+    Open the Gemini client's connection with a cheap metadata call so the first
+    generate_content_stream doesn't pay connection setup. Runs once per model.
+    """
+    if model_name in _warmed_models or client is None:
+        return
+    try:
+        client.models.get(model=model_name)
+        _warmed_models.add(model_name)
+    except Exception as e:
+        logger.warning(f"Gemini warm-up failed: {e}")
+
+async def warm_up_expert_agent() -> None:
+    """
+    Pre-warm the Pinecone index handle and Gemini connection so the first
+    expert query of the process doesn't pay lazy connection setup.
+    Called from the app lifespan on startup.
+    """
+    await _run_blocking(index.describe_index_stats)
+    await _run_blocking(_warm_gemini_connection, settings.GENERAL_MODEL or "gemini-3-flash-preview")
+
+def _answer_cache_key(scope: tuple, query: str) -> tuple:
+    return scope + (" ".join(query.lower().split()),)
 
 async def stream_expert_answer(
     query: str,
@@ -194,6 +547,21 @@ async def stream_expert_answer(
     Returns SSE events: type=token (text) and type=metadata (meds/labs).
     """
     try:
+        # 0. Answer cache
+        cache_key = _answer_cache_key((hospital_id, user_hospital_id, category, strict_hospital), query)
+        cached = _answer_cache.get(cache_key)
+        if cached:
+            text = cached["text"]
+            for start in range(0, len(text), SSE_FLUSH_CHARS):
+                yield sse_token(text[start:start + SSE_FLUSH_CHARS])
+            yield sse_event({'type': 'metadata', 'medications': cached['medications'], 'lab_tests': cached['lab_tests']})
+            yield sse_event({'type': 'done'})
+            return
+
+        # Warm the Gemini connection while retrieval runs
+        model_name = settings.GENERAL_MODEL or "gemini-3-flash-preview"
+        warmup = asyncio.create_task(_run_blocking(_warm_gemini_connection, model_name))
+
         # 1. Retrieve Context
         relevant_checks = await retrieve_checks(
             query=query,
@@ -205,34 +573,35 @@ async def stream_expert_answer(
         )
         
         # 2. Format Context & Collect Metadata
-        context_str = ""
         unique_meds = set()
         unique_labs = set()
         
         if not relevant_checks:
             context_str = "No specific past experiences found for this query."
         else:
+            parts: list[str] = []
             for i, check in enumerate(relevant_checks, 1):
-                source_type = check.get('source', 'Unknown')
-                content = check.get('check_text', '')
-                meds = check.get('medication', '')
-                labs = check.get('lab_test', '')
+                source_type = check.source
+                content = check.check_text
+                meds = check.medication
+                labs = check.lab_test
                 
-                context_str += f"\n--- Experience {i} ({source_type}) ---\n"
-                context_str += f"Insight: {content}\n"
+                parts.append(f"\n--- Experience {i} ({source_type}) ---\nInsight: {content}\n")
                 
                 # Only show meds/labs in context if not restricted
                 if "Restricted" not in meds and meds:
-                    context_str += f"Medication Used: {meds}\n"
-                    # Add to metadata collection (split by comma if needed)
-                    for m in meds.split(','):
-                        if m.strip(): unique_meds.add(m.strip())
+                    parts.append(f"Medication Used: {meds}\n")
+                    # Add to metadata collection (pre-split at upsert; legacy vectors fall back to splitting)
+                    meds_list = check.medication_list
+                    unique_meds.update(meds_list if meds_list is not None else _split_csv(meds))
                         
                 if "Restricted" not in labs and labs:
-                    context_str += f"Lab Tests Ordered: {labs}\n"
+                    parts.append(f"Lab Tests Ordered: {labs}\n")
                     # Add to metadata collection
-                    for l in labs.split(','):
-                        if l.strip(): unique_labs.add(l.strip())
+                    labs_list = check.lab_test_list
+                    unique_labs.update(labs_list if labs_list is not None else _split_csv(labs))
+
+            context_str = "".join(parts)
 
         # 3. Generate Answer
         system_prompt = f"""You are an Expert Medical AI assistant for doctors.
@@ -246,21 +615,44 @@ Context:
 
 User Query: {query}
 """
-        model_name = settings.GENERAL_MODEL or "gemini-3-flash-preview"
+        await warmup
         
-        response = client.models.generate_content_stream(
+        # The Gemini stream is a sync iterator; drive it on a worker thread so
+        # the event loop keeps serving other requests between tokens
+        response = aiter_in_thread(
+            client.models.generate_content_stream,
             model=model_name,
             contents=system_prompt
         )
         
-        for chunk in response:
+        # Coalesce small Gemini chunks into fewer SSE frames (size- or time-bounded)
+        buf = []
+        buf_len = 0
+        last_flush = time.monotonic()
+        answer_parts = []
+        async for chunk in response:
             if chunk.text:
-                yield f"data: {json.dumps({'type': 'token', 'content': chunk.text})}\n\n"
+                answer_parts.append(chunk.text)
+                buf.append(chunk.text)
+                buf_len += len(chunk.text)
+                if buf_len >= SSE_FLUSH_CHARS or time.monotonic() - last_flush >= SSE_FLUSH_SECONDS:
+                    yield sse_token(''.join(buf))
+                    buf = []
+                    buf_len = 0
+                    last_flush = time.monotonic()
+
+        if buf:
+            yield sse_token(''.join(buf))
         
         # 4. Stream Metadata (Medications and Labs)
-        yield f"data: {json.dumps({'type': 'metadata', 'medications': list(unique_meds), 'lab_tests': list(unique_labs)})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        medications = list(unique_meds)
+        lab_tests = list(unique_labs)
+        yield sse_event({'type': 'metadata', 'medications': medications, 'lab_tests': lab_tests})
+        yield sse_event({'type': 'done'})
+
+        if answer_parts:
+            _answer_cache.set(cache_key, {"text": "".join(answer_parts), "medications": medications, "lab_tests": lab_tests})
                 
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield sse_event({'type': 'error', 'message': str(e)})
 
@@ -2,14 +2,36 @@ import logging
 import os
 import re
 import httpx
-from typing import Optional
+from functools import lru_cache
+from typing import BinaryIO, Optional, Union
 from app.core.config import settings
+from app.utils.http_client import get_http_client
+from app.utils.cache import TTLCache
+from app.utils.sse_parser import SSEParser
 logger = logging.getLogger(__name__)
 
+__all__ = [
+    "MedVQA",
+    "MedSkinIndia",
+    "MedASR",
+    "MedSigLIP",
+    "MedHEAR",
+    "get_vqa_chain",
+    "get_medasr_chain",
+    "get_siglip_model",
+    "get_skin_chain",
+    "get_hear_model",
+]
+
 # Base URL for the HF Space
 # Endpoint: https://nagireddy5-lifehealth-v1.hf.space
 SPACE_URL = settings.HUGGINGFACE_SPACE
 
+# MedASR output cleanup: CTC blank / special tokens and duplicate adjacent words
+# (caused by CTC alignment overlap). Compiled once at import.
+_CTC_TOKENS = {"<epsilon>": "", "</s>": "", "<pad>": ""}
+_CTC_RE = re.compile("|".join(map(re.escape, _CTC_TOKENS)))
+_DUP_RE = re.compile(r'\b(\w+)( \1\b)+')
 
 class MedVQA:
     """Generic Medical Vision Question Answering via /agent/vision (MedGemma base)."""
@@ -22,7 +44,7 @@ class MedVQA:
 
     async def answer_question(self, question: str, image_path: Optional[str] = None):
         """
-        Sends query to the vision endpoint (StreamingResponse / text/plain).
+        Sends query to the vision endpoint (StreamingResponse / text/plain, or text/event-stream).
         Request Body: {"prompt": "...", "image_url": "..."}
         Yields chunks of text.
         """
@@ -32,15 +54,22 @@ class MedVQA:
         if image_path and image_path.startswith("http"):
             payload["image_url"] = image_path
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                async with client.stream("POST", endpoint, json=payload) as resp:
-                    resp.raise_for_status()
+        client = get_http_client()
+        try:
+            async with client.stream("POST", endpoint, json=payload, timeout=self.timeout) as resp:
+                resp.raise_for_status()
+                if resp.headers.get("content-type", "").startswith("text/event-stream"):
+                    # SSE upstream: re-emit one chunk per `data:` record, not per network read
+                    parser = SSEParser()
+                    async for raw in resp.aiter_bytes():
+                        for event in parser.feed(raw):
+                            yield event.data
+                else:
                     async for chunk in resp.aiter_text():
                         yield chunk
-            except Exception as e:
-                logger.error(f"MedVQA Error ({self.endpoint_path}): {e}")
-                yield f"Error connecting to AI Agent: {e}"
+        except Exception as e:
+            logger.error(f"MedVQA Error ({self.endpoint_path}): {e}")
+            yield f"Error connecting to AI Agent: {e}"
 
 
 class MedSkinIndia(MedVQA):
@@ -62,42 +91,47 @@ class MedASR:
         self.base_url = SPACE_URL
         self.timeout = 60.0
 
-    async def transcribe(self, audio_data: bytes, filename: str = "audio.wav") -> str:
+    async def transcribe(self, audio_data: Union[bytes, BinaryIO], filename: str = "audio.wav") -> str:
         """
-        Sends audio bytes as a multipart file upload to /agent/speech.
+        Sends audio bytes (or a binary file-like, streamed in chunks) as a multipart file upload to /agent/speech.
         Returns transcription string.
         """
         endpoint = f"{self.base_url}/agent/speech"
         files = {"file": (filename, audio_data, "audio/wav")}
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                resp = await client.post(endpoint, files=files)
-                resp.raise_for_status()
-                data = resp.json()
-                raw_text = data.get("transcription", "")
-                
-                # Clean out the CTC blank tokens and special EOS tags
-                clean_text = raw_text.replace("<epsilon>", "").replace("</s>", "").replace("<pad>", "")
-                
-                # Use regex to remove duplicate adjacent words (caused by CTC alignment overlap)
-                clean_text = re.sub(r'\b(\w+)( \1\b)+', r'\1', clean_text)
-                
-                # Strip extra whitespace
-                clean_text = " ".join(clean_text.split())
-
-                return clean_text
-            except Exception as e:
-                logger.error(f"MedASR Error: {e}")
-                return ""
+        client = get_http_client()
+        try:
+            resp = await client.post(endpoint, files=files, timeout=self.timeout)
+            resp.raise_for_status()
+            data = resp.json()
+            raw_text = data.get("transcription", "")
+            
+            # Clean out the CTC blank tokens and special EOS tags
+            clean_text = _CTC_RE.sub(lambda m: _CTC_TOKENS[m.group(0)], raw_text)
+            
+            # Remove duplicate adjacent words (caused by CTC alignment overlap)
+            clean_text = _DUP_RE.sub(r'\1', clean_text)
+            
+            # Strip extra whitespace
+            clean_text = " ".join(clean_text.split())
+
+            return clean_text
+        except Exception as e:
+            logger.error(f"MedASR Error: {e}")
+            return ""
 
 
 class MedSigLIP:
     """Medical image zero-shot classification via /agent/siglip/text."""
 
+    CACHE_MAX = 64
+    CACHE_TTL = 3600  # seconds; bounds how long a replaced image at the same URL keeps its label
+
     def __init__(self):
         self.base_url = SPACE_URL
         self.timeout = 30.0
+        # (image_url, candidates) -> last successful result; SSE retries re-send the same image
+        self._cache = TTLCache(maxsize=self.CACHE_MAX, ttl=self.CACHE_TTL)
 
     async def predict_text(self, image_url: str, candidates: list[str]) -> dict:
         """
@@ -105,17 +139,24 @@ class MedSigLIP:
         Request Body: {"image_url": "...", "candidates": [...]}
         Returns: {"prediction": "...", "confidence": 0.95}
         """
+        key = (image_url, tuple(candidates))
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
         endpoint = f"{self.base_url}/agent/siglip/text"
         payload = {"image_url": image_url, "candidates": candidates}
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                resp = await client.post(endpoint, json=payload)
-                resp.raise_for_status()
-                return resp.json()
-            except Exception as e:
-                logger.error(f"MedSigLIP Error: {e}")
-                return {}
+        client = get_http_client()
+        try:
+            resp = await client.post(endpoint, json=payload, timeout=self.timeout)
+            resp.raise_for_status()
+            result = resp.json()
+            self._cache.set(key, result)
+            return result
+        except Exception as e:
+            logger.error(f"MedSigLIP Error: {e}")
+            return {}
 
 
 class MedHEAR:
@@ -138,66 +179,48 @@ class MedHEAR:
         endpoint = f"{self.base_url}/agent/hear/embed"
         files = {"file": (filename, audio_data, "audio/wav")}
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                resp = await client.post(endpoint, files=files)
-                resp.raise_for_status()
-                data = resp.json()
-                embeddings = data.get("embeddings", [])
-                # Response is [[...]] (batch of 1), flatten to 1D
-                if embeddings and isinstance(embeddings[0], list):
-                    return embeddings[0]
-                return embeddings
-            except Exception as e:
-                logger.error(f"MedHEAR Error: {e}")
-                return []
+        client = get_http_client()
+        try:
+            resp = await client.post(endpoint, files=files, timeout=self.timeout)
+            resp.raise_for_status()
+            data = resp.json()
+            embeddings = data.get("embeddings", [])
+            # Response is [[...]] (batch of 1), flatten to 1D
+            if embeddings and isinstance(embeddings[0], list):
+                return embeddings[0]
+            return embeddings
+        except Exception as e:
+            logger.error(f"MedHEAR Error: {e}")
+            return []
 
 
 # ── Singletons ──────────────────────────────────────────────────────────────
-
-_vqa_instance = None
-_medasr_instance = None
-_siglip_instance = None
-_skin_instance = None
-_hear_instance = None
+# Built on first use and memoized; the clients only hold config, the pooled
+# HTTP connection lives in app.utils.http_client.
 
 
+@lru_cache(maxsize=1)
 def get_vqa_chain() -> MedVQA:
-    global _vqa_instance
-    if _vqa_instance is None:
-        _vqa_instance = MedVQA()
-    return _vqa_instance
+    return MedVQA()
 
 
+@lru_cache(maxsize=1)
 def get_medasr_chain() -> MedASR:
-    global _medasr_instance
-    if _medasr_instance is None:
-        _medasr_instance = MedASR()
-    return _medasr_instance
+    return MedASR()
 
 
+@lru_cache(maxsize=1)
 def get_siglip_model() -> MedSigLIP:
-    global _siglip_instance
-    if _siglip_instance is None:
-        _siglip_instance = MedSigLIP()
-    return _siglip_instance
+    return MedSigLIP()
 
 
+@lru_cache(maxsize=1)
 def get_skin_chain() -> MedSkinIndia:
     """Returns the Indian Skin Specialist (MedGemma + LoRA) singleton."""
-    global _skin_instance
-    if _skin_instance is None:
-        _skin_instance = MedSkinIndia()
-    return _skin_instance
+    return MedSkinIndia()
 
 
+@lru_cache(maxsize=1)
 def get_hear_model() -> MedHEAR:
     """Returns the HeAR acoustic embedding model singleton."""
-    global _hear_instance
-    if _hear_instance is None:
-        _hear_instance = MedHEAR()
-    return _hear_instance
-
-
-
-
+    return MedHEAR()
@@ -1,21 +1,83 @@
-from typing import TypedDict, Optional, List, Dict
+from typing import TypedDict, Optional, List, Dict, Literal
 import logging
-import json
 import asyncio
-import httpx
-import math
+import hashlib
+from contextlib import aclosing
+from functools import lru_cache
+import numpy as np
 from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.graph import StateGraph, END, START
 from tavily import TavilyClient
 from langchain_groq import ChatGroq
 
 from app.core.config import settings
 from app.agent.LLM.llm import get_vqa_chain, get_medasr_chain, get_siglip_model, get_hear_model
 from app.utils.pdf import extract_text_from_pdf_url
+from app.utils.http_client import get_http_client, DOWNLOAD_TIMEOUT
+from app.utils.sse import sse_event, sse_token
+from app.utils.cache import TTLCache
 
 # Configure Logging
 logger = logging.getLogger("deep-research-agent")
 
+# Tavily's SDK is synchronous; one client, searched off the event loop with a cap on in-flight calls
+_tavily_semaphore = asyncio.Semaphore(4)
+
+
+@lru_cache(maxsize=1)
+def get_tavily_client() -> TavilyClient:
+    """Shared Tavily client, built on first search (TavilyClient raises without an API key)."""
+    return TavilyClient(api_key=settings.TAVILY_API_KEY)
+
+# TTL + LRU cache of Tavily responses keyed by the normalized query
+TAVILY_CACHE_TTL = 300  # seconds
+TAVILY_CACHE_MAX = 1024
+_tavily_cache = TTLCache(maxsize=TAVILY_CACHE_MAX, ttl=TAVILY_CACHE_TTL)
+
+
+# In-flight searches by cache key, so concurrent identical queries make one paid call
+_tavily_searches: Dict[str, "asyncio.Task[dict]"] = {}
+
+
+async def _tavily_search(query: str, key: str) -> dict:
+    async with _tavily_semaphore:
+        results = await asyncio.to_thread(get_tavily_client().search, query=query, max_results=1, search_depth="basic")
+    _tavily_cache.set(key, results)
+    return results
+
+
+async def cached_tavily(query: str) -> dict:
+    """Tavily search with a short-lived in-memory cache for repeated findings."""
+    normalized = " ".join(query.lower().split())
+    key = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+    hit = _tavily_cache.get(key)
+    if hit is not None:
+        return hit
+
+    task = _tavily_searches.get(key)
+    if task is None:
+        task = asyncio.create_task(_tavily_search(query, key))
+        _tavily_searches[key] = task
+        task.add_done_callback(lambda _: _tavily_searches.pop(key, None))
+    # shield: one caller being cancelled must not abort the search for the others
+    return await asyncio.shield(task)
+
+
+REPORT_MODEL = "llama-3.3-70b-versatile"
+REPORT_BATCH_MAX = 32  # max tokens per SSE frame once the stream is warm
+_SENTENCE_ENDS = (".", "?", "!", "\n")
+
+
+@lru_cache(maxsize=4)
+def get_report_llm(model: str = REPORT_MODEL, temperature: float = 0.3) -> ChatGroq:
+    """Shared ChatGroq client per (model, temperature); built on first use, not per request."""
+    return ChatGroq(
+        model=model,
+        api_key=settings.GROQ_API_KEY,
+        temperature=temperature,
+        timeout=60.0,
+    )
+
 
 # --- 1. STATE DEFINITION ---
 class ResearchState(TypedDict):
@@ -32,6 +94,14 @@ class ResearchState(TypedDict):
     siglip_label: str
     pdf_content: str
 
+    # Set by the processors so consumers don't re-scan the text fields
+    audio_ok: bool               # audio_transcription holds a transcript (or its error), not the no-input placeholder
+    audio_error: bool            # audio_transcription is a processor error / placeholder, not patient speech
+    hear_level: Literal["none", "low", "moderate", "high"]
+    image_ok: bool
+    image_error: bool            # image_findings is a MedVQA error message, not findings
+    pdf_ok: bool
+
     # Research
     tavily_results: str
 
@@ -41,32 +111,116 @@ class ResearchState(TypedDict):
 
 # --- 2. NODES (WORKERS) ---
 
+# Process-wide caps on in-flight calls per upstream model, plus a deadline per call,
+# so one hung Space request can't stall a report and bursts can't exhaust connections
+MODEL_CALL_TIMEOUT = 30.0  # seconds
+VQA_TIMEOUT = 90.0         # streamed free text; partial findings are kept on timeout
+MAX_FINDINGS_CHARS = 4096  # MedVQA text kept for research + report
+FINDINGS_TRUNCATED = "\n[Findings truncated]"
+_ASR_SEM = asyncio.Semaphore(4)
+_HEAR_SEM = asyncio.Semaphore(4)
+_VQA_SEM = asyncio.Semaphore(8)
+_SIGLIP_SEM = asyncio.Semaphore(8)
+_GROQ_SEM = asyncio.Semaphore(16)
+
+
+async def _limited(sem: asyncio.Semaphore, call, timeout: float = MODEL_CALL_TIMEOUT):
+    """Awaits `call` under `sem` with a deadline; raises TimeoutError when it's missed."""
+    async with sem:
+        return await asyncio.wait_for(call, timeout)
+
+# Placeholders returned by nodes that had no input; consumers compare against these
+NO_AUDIO = "No audio provided."
+NO_HEAR_AUDIO = "No audio provided for acoustic analysis."
+NO_IMAGE = "No image provided."
+NO_PDF = "No PDF provided."
+NO_RESEARCH = "No sufficient data to research."
+RESEARCH_FAILED = "Research failed"
+
+async def _download_audio(url: str) -> bytes:
+    """Streams an audio file into a single growing buffer (64 KiB chunks)."""
+    buf = bytearray()
+    async with get_http_client().stream("GET", url, timeout=DOWNLOAD_TIMEOUT) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes(65536):
+            buf.extend(chunk)
+    # httpx multipart uploads need bytes, not bytearray
+    return bytes(buf)
+
+
+# In-flight audio downloads by URL: MedASR and HeAR both need the same file,
+# so whichever node asks first starts the download and the other awaits it
+_audio_downloads: Dict[str, "asyncio.Task[bytes]"] = {}
+
+
+async def _fetch_audio_once(url: str) -> bytes:
+    task = _audio_downloads.get(url)
+    if task is None:
+        task = asyncio.create_task(_download_audio(url))
+        _audio_downloads[url] = task
+        task.add_done_callback(lambda _: _audio_downloads.pop(url, None))
+    # shield: one caller being cancelled must not abort the download for the other
+    return await asyncio.shield(task)
+
+
 async def process_audio(state: ResearchState):
     """
     Downloads audio from URL and transcribes it using MedASR (medical speech recognition).
     """
     if not state.get("audio_url"):
-        return {"audio_transcription": "No audio provided."}
+        return {"audio_transcription": NO_AUDIO, "audio_ok": False, "audio_error": False}
 
     try:
         audio_url = state["audio_url"]
         logger.info(f"MedASR: Processing audio from {audio_url}")
 
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(audio_url)
-            resp.raise_for_status()
-            audio_bytes = resp.content
+        audio_bytes = await _fetch_audio_once(audio_url)
 
         medasr = get_medasr_chain()
-        transcription = await medasr.transcribe(audio_bytes, filename="patient_audio.wav")
+        transcription = await _limited(_ASR_SEM, medasr.transcribe(audio_bytes, filename="patient_audio.wav"))
 
         if not transcription:
-            transcription = "Audio processing failed or silent."
+            return {"audio_transcription": "Audio processing failed or silent.", "audio_ok": True, "audio_error": True}
 
-        return {"audio_transcription": transcription}
+        return {"audio_transcription": transcription, "audio_ok": True, "audio_error": False}
+    except TimeoutError:
+        logger.error(f"MedASR timed out after {MODEL_CALL_TIMEOUT}s")
+        return {"audio_transcription": "Error: MedASR timed out.", "audio_ok": True, "audio_error": True}
     except Exception as e:
         logger.error(f"Audio processing error: {e}")
-        return {"audio_transcription": f"Error: {str(e)}"}
+        return {"audio_transcription": f"Error: {str(e)}", "audio_ok": True, "audio_error": True}
+
+
+# Rough thresholding on the HeAR embedding L2 norm (empirical — can be calibrated with labelled data)
+HEAR_NORM_THRESHOLDS = np.array([8.0, 15.0], dtype=np.float32)  # > 8 Moderate, > 15 High
+HEAR_LEVELS = (
+    ("Low", (
+        "The acoustic embedding shows a LOW energy signature. "
+        "No prominent acoustic health anomalies detected from this recording."
+    )),
+    ("Moderate", (
+        "The acoustic embedding shows a MODERATE energy signature. "
+        "Some irregularity in breathing or vocal patterns detected. "
+        "Monitor the patient and correlate with other clinical findings."
+    )),
+    ("High", (
+        "The acoustic embedding shows a HIGH energy signature, suggesting possible "
+        "respiratory distress, persistent cough, or abnormal breathing patterns. "
+        "Recommend clinical evaluation of respiratory and cardiac status."
+    )),
+)
+
+
+def summarize_hear_embeddings(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized norm + level for one (D,) or many (N, D) HeAR embeddings.
+    Returns (N,) float32 norms and (N,) indices into HEAR_LEVELS.
+    """
+    emb = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(emb, axis=1)
+    # right=True: a norm equal to a threshold stays in the lower level (strict ">")
+    levels = np.digitize(norms, HEAR_NORM_THRESHOLDS, right=True)
+    return norms, levels
 
 
 async def process_hear_audio(state: ResearchState):
@@ -77,49 +231,27 @@ async def process_hear_audio(state: ResearchState):
     The embedding vector magnitude is used as a proxy for acoustic health anomaly level.
     """
     if not state.get("audio_url"):
-        return {"hear_summary": "No audio provided for acoustic analysis."}
+        return {"hear_summary": NO_HEAR_AUDIO, "hear_level": "none"}
 
     try:
         audio_url = state["audio_url"]
         logger.info(f"HeAR: Generating acoustic embeddings from {audio_url}")
 
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(audio_url)
-            resp.raise_for_status()
-            audio_bytes = resp.content
+        audio_bytes = await _fetch_audio_once(audio_url)
 
         hear = get_hear_model()
-        embedding = await hear.embed(audio_bytes, filename="patient_audio.wav")
+        embedding = await _limited(_HEAR_SEM, hear.embed(audio_bytes, filename="patient_audio.wav"))
 
         if not embedding:
-            return {"hear_summary": "HeAR acoustic analysis unavailable for this audio."}
+            return {"hear_summary": "HeAR acoustic analysis unavailable for this audio.", "hear_level": "none"}
 
         # Interpret embedding: compute L2 norm as a rough acoustic energy / anomaly indicator
         # High norm → acoustically rich / potentially abnormal signal
-        norm = math.sqrt(sum(x ** 2 for x in embedding))
-        dim = len(embedding)
-
-        # Rough thresholding (empirical — can be calibrated with labelled data)
-        if norm > 15:
-            anomaly_level = "High"
-            interpretation = (
-                "The acoustic embedding shows a HIGH energy signature, suggesting possible "
-                "respiratory distress, persistent cough, or abnormal breathing patterns. "
-                "Recommend clinical evaluation of respiratory and cardiac status."
-            )
-        elif norm > 8:
-            anomaly_level = "Moderate"
-            interpretation = (
-                "The acoustic embedding shows a MODERATE energy signature. "
-                "Some irregularity in breathing or vocal patterns detected. "
-                "Monitor the patient and correlate with other clinical findings."
-            )
-        else:
-            anomaly_level = "Low"
-            interpretation = (
-                "The acoustic embedding shows a LOW energy signature. "
-                "No prominent acoustic health anomalies detected from this recording."
-            )
+        arr = embedding if isinstance(embedding, np.ndarray) else np.asarray(embedding, dtype=np.float32)
+        norms, levels = summarize_hear_embeddings(arr)
+        norm = float(norms[0])
+        dim = arr.size
+        anomaly_level, interpretation = HEAR_LEVELS[levels[0]]
 
         summary = (
             f"HeAR Acoustic Analysis (embedding dim={dim}, L2 norm={norm:.2f}):\n"
@@ -128,11 +260,20 @@ async def process_hear_audio(state: ResearchState):
         )
 
         logger.info(f"HeAR summary generated — norm={norm:.2f}, level={anomaly_level}")
-        return {"hear_summary": summary}
+        return {"hear_summary": summary, "hear_level": anomaly_level.lower()}
 
+    except TimeoutError:
+        logger.error(f"HeAR timed out after {MODEL_CALL_TIMEOUT}s")
+        return {"hear_summary": "HeAR analysis error: timed out.", "hear_level": "none"}
     except Exception as e:
         logger.error(f"HeAR processing error: {e}")
-        return {"hear_summary": f"HeAR analysis error: {str(e)}"}
+        return {"hear_summary": f"HeAR analysis error: {str(e)}", "hear_level": "none"}
+
+
+# (image_url, prompt hash) -> (findings, label); MedVQA is re-run only for new pairs
+_image_analysis_cache = TTLCache(maxsize=64, ttl=3600)
+VQA_ERROR_PREFIX = "Error in MedVQA"
+VQA_CONNECT_ERROR_PREFIX = "Error connecting to AI Agent"  # yielded by MedVQA itself
 
 
 async def process_image(state: ResearchState):
@@ -140,121 +281,321 @@ async def process_image(state: ResearchState):
     Analyzes image using MedVQA (streaming → full text) and MedSigLIP zero-shot classification.
     """
     if not state.get("image_url"):
-        return {"image_findings": "No image provided.", "siglip_label": "N/A"}
+        return {"image_findings": NO_IMAGE, "siglip_label": "N/A", "image_ok": False, "image_error": False}
 
     image_url = state["image_url"]
     prompt = state.get("vision_prompt", "Describe the medical findings in detail.")
 
-    findings = ""
-    label = "N/A"
+    cache_key = (image_url, hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest())
+    cached = _image_analysis_cache.get(cache_key)
+    if cached is not None:
+        findings, label = cached
+        return {"image_findings": findings, "siglip_label": label, "image_ok": True, "image_error": False}
+
+    # MedVQA and SigLIP are independent calls on the same image; run them concurrently.
+    # return_exceptions: a failure in one must not discard the other's result
+    vqa, label = await asyncio.gather(
+        _collect_vqa_findings(prompt, image_url),
+        _classify_siglip(image_url),
+        return_exceptions=True,
+    )
+    if isinstance(vqa, BaseException):
+        vqa = (f"{VQA_ERROR_PREFIX}: {vqa}", False, True)
+    if isinstance(label, BaseException):
+        logger.warning(f"SigLIP error: {label}")
+        label = "N/A"
+    findings, complete, failed = vqa
+
+    # Only cache full answers; errors, timeouts and partial streams get retried next time
+    if complete:
+        _image_analysis_cache.set(cache_key, (findings, label))
 
-    # 1. MedVQA — detailed visual analysis
+    return {"image_findings": findings, "siglip_label": label, "image_ok": True, "image_error": failed}
+
+
+async def _collect_vqa_findings(prompt: str, image_url: str) -> tuple[str, bool, bool]:
+    """
+    MedVQA — detailed visual analysis (streamed, collected to full text).
+    Returns (findings, complete, failed): complete is False on error or timeout;
+    failed is True when findings is an error message rather than model output.
+    """
+    findings_parts: list[str] = []
+    total = 0
     try:
         llm_vqa = get_vqa_chain()
-        async for chunk in llm_vqa.answer_question(question=prompt, image_path=image_url):
-            findings += chunk
+        async with _VQA_SEM, asyncio.timeout(VQA_TIMEOUT), \
+                aclosing(llm_vqa.answer_question(question=prompt, image_path=image_url)) as vqa_stream:
+            async for chunk in vqa_stream:
+                # Bound the findings here rather than at each consumer; breaking out also
+                # closes the upstream stream instead of downloading text we'd discard
+                if total + len(chunk) >= MAX_FINDINGS_CHARS:
+                    findings_parts.append(chunk[:MAX_FINDINGS_CHARS - total])
+                    findings_parts.append(FINDINGS_TRUNCATED)
+                    logger.info(f"MedVQA findings capped at {MAX_FINDINGS_CHARS} chars")
+                    break
+                findings_parts.append(chunk)
+                total += len(chunk)
+    except TimeoutError:
+        # Keep whatever streamed in before the deadline
+        logger.warning(f"MedVQA timed out after {VQA_TIMEOUT}s; using partial findings")
+        if findings_parts:
+            return "".join(findings_parts), False, False
+        return f"{VQA_ERROR_PREFIX}: timed out.", False, True
     except Exception as e:
-        findings = f"Error in MedVQA: {e}"
+        return f"{VQA_ERROR_PREFIX}: {e}", False, True
+    # MedVQA reports connection failures in-band as its final chunk
+    failed = not findings_parts or findings_parts[-1].startswith(VQA_CONNECT_ERROR_PREFIX)
+    return "".join(findings_parts), not failed, failed
+
+
+# Zero-shot labels for MedSigLIP; fixed, so built once rather than per image
+SIGLIP_CANDIDATES = ["Normal", "Fracture", "Pneumonia", "Infection", "Tumor", "Hemorrhage"]
+
 
-    # 2. MedSigLIP — zero-shot classification label
+async def _classify_siglip(image_url: str) -> str:
+    """MedSigLIP — zero-shot classification label."""
     try:
         siglip = get_siglip_model()
-        candidates = ["Normal", "Fracture", "Pneumonia", "Infection", "Tumor", "Hemorrhage"]
-        result = await siglip.predict_text(image_url=image_url, candidates=candidates)
-        label = result.get("prediction", "N/A")
+        result = await _limited(_SIGLIP_SEM, siglip.predict_text(image_url=image_url, candidates=SIGLIP_CANDIDATES))
+        return result.get("prediction", "N/A")
+    except TimeoutError:
+        logger.warning(f"SigLIP timed out after {MODEL_CALL_TIMEOUT}s")
+        return "N/A"
     except Exception as e:
         logger.warning(f"SigLIP error: {e}")
-
-    return {"image_findings": findings, "siglip_label": label}
+        return "N/A"
 
 
 async def process_pdf(state: ResearchState):
     """Extracts text from PDF URL (up to 10,000 chars for LLM context)."""
     if not state.get("pdf_url"):
-        return {"pdf_content": "No PDF provided."}
+        return {"pdf_content": NO_PDF, "pdf_ok": False}
 
     try:
-        text = await extract_text_from_pdf_url(state["pdf_url"])
-        return {"pdf_content": text[:10000]}
+        text = await extract_text_from_pdf_url(state["pdf_url"], max_chars=10000)
+        return {"pdf_content": text, "pdf_ok": True}
     except Exception as e:
-        return {"pdf_content": f"Error extracting PDF: {e}"}
+        return {"pdf_content": f"Error extracting PDF: {e}", "pdf_ok": True}
+
+
+def _early_research_query(state: ResearchState) -> Optional[str]:
+    """Query that can run as soon as the image is classified, before audio/PDF finish."""
+    label = state.get("siglip_label")
+    if label and label != "N/A":
+        return f"{label} treatment guidelines"
+    return None
+
+
+MAX_QUERY_CHARS = 400  # Tavily rejects longer queries
+
+
+def _truncate_query(query: str, limit: int = MAX_QUERY_CHARS) -> str:
+    if len(query) <= limit:
+        return query
+    cut = query.rfind(" ", 0, limit + 1)
+    return query[:cut if cut > 0 else limit]
 
 
-async def deep_research(state: ResearchState):
+async def deep_research(state: ResearchState, early_search: Optional["asyncio.Future[dict]"] = None):
     """
     Uses Tavily to find medical context based on multi-modal findings.
     Incorporates HeAR anomaly level into search queries.
+    `early_search` is a speculative label-only search started while other processors
+    were still running; its hits are merged after the main query's, and the label is
+    then left out of the main query.
     """
     query_parts = []
 
-    if state.get("siglip_label") and state["siglip_label"] != "N/A":
+    if early_search is None and state.get("siglip_label") and state["siglip_label"] != "N/A":
         query_parts.append(f"{state['siglip_label']} treatment guidelines")
 
-    if state.get("image_findings") and len(state["image_findings"]) > 20:
-        query_parts.append(f"medical consensus on {state['image_findings'][:100]}")
+    image_findings = state.get("image_findings")
+    if state.get("image_ok") and not state.get("image_error") and len(image_findings or "") > 20:
+        query_parts.append(f"medical consensus on {image_findings[:100]}")
 
-    if state.get("audio_transcription") and "No audio" not in state["audio_transcription"]:
-        query_parts.append(f"symptoms: {state['audio_transcription'][:100]}")
+    audio_transcription = state.get("audio_transcription")
+    if state.get("audio_ok") and not state.get("audio_error") and audio_transcription:
+        query_parts.append(f"symptoms: {audio_transcription[:100]}")
 
     # NEW: Add HeAR high-anomaly signals to research query
-    hear_summary = state.get("hear_summary", "")
-    if "High" in hear_summary:
+    hear_level = state.get("hear_level", "none")
+    if hear_level == "high":
         query_parts.append("respiratory distress cough anomaly clinical evaluation guidelines")
-    elif "Moderate" in hear_summary:
+    elif hear_level == "moderate":
         query_parts.append("breathing irregularity monitoring clinical assessment")
 
-    if not query_parts:
+    # The early label search alone is enough when nothing else was found
+    if not query_parts and early_search is None:
         if state.get("vision_prompt"):
             query_parts.append(state["vision_prompt"])
         else:
-            return {"tavily_results": "No sufficient data to research."}
-
-    query = " ".join(query_parts)
-    logger.info(f"Tavily Search Query: {query}")
+            return {"tavily_results": NO_RESEARCH}
 
     try:
-        tavily_client = TavilyClient(api_key=settings.TAVILY_API_KEY)
-        results = tavily_client.search(query=query, max_results=1, search_depth="basic")
+        hits = []
+        if query_parts:
+            query = _truncate_query(" ".join(query_parts))
+            logger.info(f"Tavily Search Query: {query}")
+            results = await cached_tavily(query)
+            hits.extend(results.get("results", []))
+
+        if early_search is not None:
+            try:
+                hits.extend((await early_search).get("results", []))
+            except Exception as e:
+                logger.warning(f"Early Tavily search failed: {e}")
 
         formatted_results = ""
-        for res in results.get("results", []):
+        seen_urls = set()
+        for res in hits:
+            if res["url"] in seen_urls:
+                continue
+            seen_urls.add(res["url"])
             formatted_results += f"- **[{res['title']}]({res['url']})**: {res['content'][:300]}...\n"
 
         return {"tavily_results": formatted_results}
     except Exception as e:
         logger.error(f"Tavily error: {e}")
-        return {"tavily_results": f"Research failed: {e}"}
+        return {"tavily_results": f"{RESEARCH_FAILED}: {e}"}
+
+
+# --- 3. FAN-OUT ---
+# audio, hear, image, pdf run concurrently → deep_research → final synthesis
+
+PROCESSORS = {
+    "process_audio":      process_audio,
+    "process_hear_audio": process_hear_audio,
+    "process_image":      process_image,
+    "process_pdf":        process_pdf,
+}
+
+STATUS_MESSAGES = {
+    "process_audio":      "MedASR: Audio Transcribed.",
+    "process_hear_audio": "HeAR: Acoustic Analysis Complete.",
+    "process_image":      "MedVQA + SigLIP: Image Analyzed.",
+    "process_pdf":        "PDF: Text Extracted.",
+    "deep_research":      "Tavily: Research Completed.",
+}
+
+
+async def _run_node(name: str, node, state: ResearchState):
+    return name, await node(state)
+
+
+# --- 4. REPORT SYNTHESIS ---
+
+REPORT_SYSTEM_PROMPT = """You are a Medical Research Assistant.
+Create a concise, professional medical report from the multi-modal inputs provided.
+Structure your response as:
+1. Patient Overview (Symptoms / Complaints)
+2. Image Findings (if applicable)
+3. Acoustic Health Analysis (HeAR — respiratory/cardiac patterns if applicable)
+4. Research Insight (brief)
+5. Recommendations
+Keep the tone clinical and precise."""
+
+# Used when the report starts before Tavily returns; the insight is streamed after it
+REPORT_SYSTEM_PROMPT_PRE_RESEARCH = """You are a Medical Research Assistant.
+Create a concise, professional medical report from the multi-modal inputs provided.
+Structure your response as:
+1. Patient Overview (Symptoms / Complaints)
+2. Image Findings (if applicable)
+3. Acoustic Health Analysis (HeAR — respiratory/cardiac patterns if applicable)
+4. Recommendations
+Do not write a research section; it is added separately.
+Keep the tone clinical and precise."""
+
+RESEARCH_INSIGHT_PROMPT = """You are a Medical Research Assistant.
+You are given a medical report and web research results for it.
+Write only a brief "Research Insight" section that relates the research to the report's findings,
+citing sources as markdown links. Do not repeat the report.
+Keep the tone clinical and precise."""
 
+# System messages are built once; the fixed system text and section headers keep the
+# request prefix byte-identical across calls, which Groq's prompt cache keys on
+REPORT_SYSTEM_MESSAGE = SystemMessage(content=REPORT_SYSTEM_PROMPT)
+REPORT_SYSTEM_MESSAGE_PRE_RESEARCH = SystemMessage(content=REPORT_SYSTEM_PROMPT_PRE_RESEARCH)
+RESEARCH_INSIGHT_MESSAGE = SystemMessage(content=RESEARCH_INSIGHT_PROMPT)
 
-# --- 3. GRAPH DEFINITION ---
-# Parallel fan-out: audio, hear, image, pdf → deep_research → END
+# Prompt sections, in the order they appear in the user message
+INPUTS_HEADER = "-- MULTI-MODAL INPUTS --"
+IMAGE_URL_SECTION = "[Image URL]: {}"
+AUDIO_SECTION = "\n-- AUDIO TRANSCRIPT (MedASR) --\n{}"
+HEAR_SECTION = "\n-- ACOUSTIC HEALTH ANALYSIS (HeAR) --\n{}"
+IMAGE_SECTION = "\n-- IMAGE ANALYSIS (SigLIP Label: {}) --\n{}"
+PDF_SECTION = "\n-- PDF CONTENT --\n{}"
+RESEARCH_SECTION = "\n-- MEDICAL RESEARCH --\n{}"
+FOLLOWUP_TEMPLATE = "-- REPORT SO FAR --\n{}\n\n-- MEDICAL RESEARCH --\n{}"
 
-workflow = StateGraph(ResearchState)
+RESEARCH_GRACE = 0.3  # seconds to wait for Tavily before starting the report without it
 
-workflow.add_node("process_audio", process_audio)
-workflow.add_node("process_hear_audio", process_hear_audio)   # NEW HeAR node
-workflow.add_node("process_image", process_image)
-workflow.add_node("process_pdf", process_pdf)
-workflow.add_node("deep_research", deep_research)
 
-# Fan-out: all four processors run in parallel from START
-workflow.add_edge(START, "process_audio")
-workflow.add_edge(START, "process_hear_audio")                # NEW
-workflow.add_edge(START, "process_image")
-workflow.add_edge(START, "process_pdf")
+def _build_report_prompt(state: ResearchState, include_research: bool = True) -> str:
+    prompt_parts = [INPUTS_HEADER]
 
-# Fan-in: all feed into deep_research
-workflow.add_edge("process_audio", "deep_research")
-workflow.add_edge("process_hear_audio", "deep_research")      # NEW
-workflow.add_edge("process_image", "deep_research")
-workflow.add_edge("process_pdf", "deep_research")
+    image_url = state.get("image_url")
+    if image_url:
+        prompt_parts.append(IMAGE_URL_SECTION.format(image_url))
+
+    audio_transcription = state.get("audio_transcription")
+    hear_summary = state.get("hear_summary")
+    image_findings = state.get("image_findings")
+    pdf_content = state.get("pdf_content")
+    tavily_results = state.get("tavily_results")
+
+    if state.get("audio_ok") and audio_transcription:
+        prompt_parts.append(AUDIO_SECTION.format(audio_transcription))
+
+    # NEW: include HeAR acoustic summary
+    if state.get("audio_url") and hear_summary:
+        prompt_parts.append(HEAR_SECTION.format(hear_summary))
+
+    if state.get("image_ok") and image_findings:
+        label = state.get("siglip_label", "N/A")
+        prompt_parts.append(IMAGE_SECTION.format(label, image_findings))
+
+    if state.get("pdf_ok") and pdf_content:
+        prompt_parts.append(PDF_SECTION.format(pdf_content))
 
-workflow.add_edge("deep_research", END)
+    if include_research and tavily_results:
+        prompt_parts.append(RESEARCH_SECTION.format(tavily_results))
 
-app_graph = workflow.compile()
+    return "\n".join(prompt_parts)
+
+
+async def _stream_report(llm: ChatGroq, system_message: SystemMessage, user_prompt: str, collected: Optional[List[str]] = None):
+    """
+    Streams one Groq completion as SSE token frames.
+    Progressive batching: first token goes out alone (fast first paint), then
+    frames coalesce 2 → 4 → ... → REPORT_BATCH_MAX tokens, flushing early on sentence ends.
+    """
+    buf = []
+    target = 1
+    try:
+        async with _GROQ_SEM:
+            async for chunk in llm.astream([system_message, HumanMessage(content=user_prompt)]):
+                token = chunk.content
+                if not token:
+                    continue
+                if collected is not None:
+                    collected.append(token)
+                buf.append(token)
+                if len(buf) >= target or token.endswith(_SENTENCE_ENDS):
+                    yield sse_token("".join(buf))
+                    buf.clear()
+                    target = min(target * 2, REPORT_BATCH_MAX)
+    except Exception as e:
+        logger.error(f"Groq Stream Error: {e}")
+        if buf:
+            yield sse_token("".join(buf))
+            buf.clear()
+        yield sse_event({'type': 'status', 'message': f'Error generating report: {e}'})
+    else:
+        if buf:
+            yield sse_token("".join(buf))
 
 
-# --- 4. ENTRY POINT ---
+# --- 5. ENTRY POINT ---
 
 async def run_deep_research(
     image_url: Optional[str] = None,
@@ -263,14 +604,21 @@ async def run_deep_research(
     vision_prompt: Optional[str] = None
 ):
     """
-    Async generator that runs the full multi-modal research graph and yields SSE events.
+    Async generator that runs the full multi-modal research pipeline and yields SSE events.
 
     SSE Event Types:
       - {"type": "status", "message": "..."}   — pipeline progress updates
       - {"type": "token",  "content": "..."}   — streamed report tokens
       - {"type": "done"}                        — stream complete
     """
-    inputs = {
+    if not any((image_url, audio_url, pdf_url, vision_prompt)):
+        yield sse_event({'type': 'status', 'message': 'No inputs provided.'})
+        yield sse_event({'type': 'done'})
+        return
+
+    # One state dict for the whole run: processors only read the input keys and
+    # each writes disjoint output keys, so outputs are merged in place (no copies)
+    final_state: ResearchState = {
         "image_url": image_url,
         "audio_url": audio_url,
         "pdf_url": pdf_url,
@@ -280,78 +628,79 @@ async def run_deep_research(
         "image_findings": "",
         "siglip_label": "",
         "pdf_content": "",
+        "audio_ok": False,
+        "audio_error": False,
+        "hear_level": "none",
+        "image_ok": False,
+        "image_error": False,
+        "pdf_ok": False,
         "tavily_results": "",
         "final_report": "",
     }
 
-    yield f"data: {json.dumps({'type': 'status', 'message': 'Starting Deep Research...'})}\n\n"
+    yield sse_event({'type': 'status', 'message': 'Starting Deep Research...'})
 
-    final_state = inputs.copy()
+    early_search = None
 
-    async for output in app_graph.astream(inputs):
-        for node_name, node_output in output.items():
+    # Fan-out: all processors start together; report each as it finishes
+    tasks = [asyncio.create_task(_run_node(name, node, final_state)) for name, node in PROCESSORS.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            node_name, node_output = await next_done
             final_state.update(node_output)
+            if node_name == "process_image" and early_search is None:
+                # Start researching the image label while audio/PDF are still running
+                early_query = _early_research_query(final_state)
+                if early_query:
+                    early_search = asyncio.create_task(cached_tavily(early_query))
+            yield sse_event({'type': 'status', 'message': STATUS_MESSAGES[node_name]})
+    except BaseException:
+        if early_search is not None:
+            early_search.cancel()
+        raise
+    finally:
+        # Client disconnected or a node failed: don't leave orphaned work running
+        for task in tasks:
+            task.cancel()
+
+    # Fan-in: research on the combined findings. Tavily only feeds the "Research
+    # Insight" section, so if it is not back within a short grace period the report
+    # starts streaming without it and the insight follows as a second pass.
+    research_task = asyncio.create_task(deep_research(final_state, early_search))
+    try:
+        done, _ = await asyncio.wait({research_task}, timeout=RESEARCH_GRACE)
 
-            status_map = {
-                "process_audio":      "MedASR: Audio Transcribed.",
-                "process_hear_audio": "HeAR: Acoustic Analysis Complete.",
-                "process_image":      "MedVQA + SigLIP: Image Analyzed.",
-                "process_pdf":        "PDF: Text Extracted.",
-                "deep_research":      "Tavily: Research Completed.",
-            }
-            if node_name in status_map:
-                yield f"data: {json.dumps({'type': 'status', 'message': status_map[node_name]})}\n\n"
-
-    yield f"data: {json.dumps({'type': 'status', 'message': 'Synthesizing Final Report (Llama 3.3 70B)...'})}\n\n"
-
-    # Final synthesis — Llama 3.3 70B (via Groq) for strong medical reasoning
-    llm = ChatGroq(
-        model="llama-3.3-70b-versatile",
-        api_key=settings.GROQ_API_KEY,
-        temperature=0.3,
-    )
-
-    system_prompt = """You are a Medical Research Assistant.
-Create a concise, professional medical report from the multi-modal inputs provided.
-Structure your response as:
-1. Patient Overview (Symptoms / Complaints)
-2. Image Findings (if applicable)
-3. Acoustic Health Analysis (HeAR — respiratory/cardiac patterns if applicable)
-4. Research Insight (brief)
-5. Recommendations
-Keep the tone clinical and precise."""
-
-    prompt_parts = ["-- MULTI-MODAL INPUTS --"]
-
-    if image_url:
-        prompt_parts.append(f"[Image URL]: {image_url}")
-
-    if final_state.get("audio_transcription") and "No audio" not in final_state["audio_transcription"]:
-        prompt_parts.append(f"\n-- AUDIO TRANSCRIPT (MedASR) --\n{final_state['audio_transcription']}")
-
-    # NEW: include HeAR acoustic summary
-    if final_state.get("hear_summary") and "No audio" not in final_state["hear_summary"]:
-        prompt_parts.append(f"\n-- ACOUSTIC HEALTH ANALYSIS (HeAR) --\n{final_state['hear_summary']}")
-
-    if final_state.get("image_findings") and "No image" not in final_state["image_findings"]:
-        label = final_state.get("siglip_label", "N/A")
-        prompt_parts.append(f"\n-- IMAGE ANALYSIS (SigLIP Label: {label}) --\n{final_state['image_findings']}")
-
-    if final_state.get("pdf_content") and "No PDF" not in final_state["pdf_content"]:
-        prompt_parts.append(f"\n-- PDF CONTENT --\n{final_state['pdf_content']}")
-
-    if final_state.get("tavily_results"):
-        prompt_parts.append(f"\n-- MEDICAL RESEARCH --\n{final_state['tavily_results']}")
-
-    user_prompt = "\n".join(prompt_parts)
+        # Final synthesis — Llama 3.3 70B (via Groq) for strong medical reasoning
+        llm = get_report_llm()
 
-    try:
-        async for chunk in llm.astream([SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)]):
-            token = chunk.content
-            if token:
-                yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
-    except Exception as e:
-        logger.error(f"Groq Stream Error: {e}")
-        yield f"data: {json.dumps({'type': 'status', 'message': f'Error generating report: {e}'})}\n\n"
+        if done:
+            final_state.update(research_task.result())
+            yield sse_event({'type': 'status', 'message': STATUS_MESSAGES['deep_research']})
+            yield sse_event({'type': 'status', 'message': 'Synthesizing Final Report (Llama 3.3 70B)...'})
 
-    yield f"data: {json.dumps({'type': 'done'})}\n\n"
\ No newline at end of file
+            async for frame in _stream_report(llm, REPORT_SYSTEM_MESSAGE, _build_report_prompt(final_state)):
+                yield frame
+        else:
+            yield sse_event({'type': 'status', 'message': 'Synthesizing Final Report (Llama 3.3 70B)...'})
+
+            report_parts = []
+            async for frame in _stream_report(
+                llm, REPORT_SYSTEM_MESSAGE_PRE_RESEARCH, _build_report_prompt(final_state, include_research=False), report_parts
+            ):
+                yield frame
+
+            final_state.update(await research_task)
+            yield sse_event({'type': 'status', 'message': STATUS_MESSAGES['deep_research']})
+
+            tavily_results = final_state["tavily_results"]
+            if tavily_results and tavily_results != NO_RESEARCH and not tavily_results.startswith(RESEARCH_FAILED):
+                followup_prompt = FOLLOWUP_TEMPLATE.format("".join(report_parts), tavily_results)
+                yield sse_token("\n\n")
+                async for frame in _stream_report(llm, RESEARCH_INSIGHT_MESSAGE, followup_prompt):
+                    yield frame
+    finally:
+        research_task.cancel()
+        if early_search is not None:
+            early_search.cancel()
+
+    yield sse_event({'type': 'done'})
@@ -1,28 +1,20 @@
-import json
 from google import genai
+from google.genai import types
 from app.core.config import settings
 from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.appointment import Appointment
+from app.utils.sse import sse_event, sse_token
 
 # Configure Gemini client
 client = None
 if settings.GOOGLE_API_KEY:
     client = genai.Client(api_key=settings.GOOGLE_API_KEY)
 
-async def stream_diet_plan(appointment_id: str, patient_problem: str, doctor_remarks: str, db: AsyncSession):
-    """
-    Generate and stream a diet plan using Gemini API based on patient's problem and doctor's remarks.
-    Returns SSE events with the generated plan.
-    """
-    try:
-        system_prompt = f"""You are an Expert Clinical Nutritionist and Healthcare Professional working as a Diet Planner Agent.
+DIET_PLANNER_SYSTEM_PROMPT = """You are an Expert Clinical Nutritionist and Healthcare Professional working as a Diet Planner Agent.
 Your task is to create a highly specific, customized, day-wise diet plan for a patient based on their diagnosed problem and their doctor's exact remarks.
 You MUST strictly follow the doctor's constraints and recommendations.
 
-Patient Problem: {patient_problem}
-Doctor's Remarks: {doctor_remarks}
-
 Requirements for the output:
 1. Provide a realistic, day-wise diet plan meant to be followed strictly.
 2. For each day, include specific timestamps or clear meal times (e.g., "08:00 AM - Breakfast:", "11:00 AM - Mid-Morning Snack:", "01:30 PM - Lunch:").
@@ -31,7 +23,7 @@ Requirements for the output:
 5. **IMPORTANT:** Include two separate sections at the end:
    - **Recommended Foods (Foods to Take):** A list of specific foods that will benefit the patient.
    - **Foods to Avoid:** A list of specific foods the patient must stay away from.
-6. **LANGUAGE CONSTRAINT:** You MUST write the entire response in the SAME LANGUAGE as the Doctor's Remarks provided above. If the remarks are in Hindi, the plan must be in Hindi. If they are in English, the plan must be in English.
+6. **LANGUAGE CONSTRAINT:** You MUST write the entire response in the SAME LANGUAGE as the Doctor's Remarks provided. If the remarks are in Hindi, the plan must be in Hindi. If they are in English, the plan must be in English.
 7. Add a brief, encouraging conclusion.
 
 Example Format:
@@ -47,18 +39,32 @@ Example Format:
 
 Remember, you are speaking directly to the user (patient) on behalf of the healthcare team. Keep a professional yet compassionate tone.
 """
+
+_DIET_PLAN_CONFIG = types.GenerateContentConfig(system_instruction=DIET_PLANNER_SYSTEM_PROMPT)
+
+async def stream_diet_plan(appointment_id: str, patient_problem: str, doctor_remarks: str, db: AsyncSession):
+    """
+    Generate and stream a diet plan using Gemini API based on patient's problem and doctor's remarks.
+    Returns SSE events with the generated plan.
+    """
+    try:
+        # Static instructions go in system_instruction so the prefix is identical on every
+        # request (cacheable upstream); only the patient-specific part varies
+        patient_details = f"Patient Problem: {patient_problem}\nDoctor's Remarks: {doctor_remarks}"
+
         model_name = settings.GENERAL_MODEL or "gemini-3-flash-preview"
         
         response = client.models.generate_content_stream(
             model=model_name,
-            contents=system_prompt
+            contents=patient_details,
+            config=_DIET_PLAN_CONFIG,
         )
         
         full_plan = ""
         for chunk in response:
             if chunk.text:
                 full_plan += chunk.text
-                yield f"data: {json.dumps({'type': 'token', 'content': chunk.text})}\n\n"
+                yield sse_token(chunk.text)
         
         # Save to database
         try:
@@ -68,7 +74,7 @@ Remember, you are speaking directly to the user (patient) on behalf of the healt
         except Exception as db_e:
             print(f"Error saving diet plan to DB: {db_e}")
 
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield sse_event({'type': 'done'})
                 
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield sse_event({'type': 'error', 'message': str(e)})
@@ -1,14 +1,17 @@
-from typing import TypedDict, Annotated, Sequence, Union
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from typing import TypedDict, Sequence
+from langchain_core.messages import BaseMessage, HumanMessage
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
+import asyncio
 import logging
-import io
-import httpx
-from PIL import Image
+import os
 
 from app.agent.LLM.llm import get_vqa_chain
+from app.agent.Tools.MemeoryTools import add_long_term_memory, get_long_term_memories
+from app.core.database import SessionLocal
+from app.models.appointment_chat import AppointmentChat
 from app.utils.pdf import extract_text_from_pdf_url
+from app.utils.sse import sse_event, sse_token
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +24,15 @@ class AgentState(TypedDict):
     local_image_path: str # For Images (downloaded temp path)
     long_term_memories: str # Context from long-term memory
 
+# Characters of extracted report text passed to the model
+REPORT_CONTEXT_CHARS = 6000
+
 # Nodes
 async def load_document(state: AgentState):
     """
     Downloads document from URL. Detects type.
     If PDF: Extract text.
-    If Image: Download to temp file.
+    If Image: Nothing to fetch; MedVQA reads the image from its URL.
     """
     url = state["document_url"]
     logger.info(f"Loading document: {url}")
@@ -35,22 +41,14 @@ async def load_document(state: AgentState):
     lower_url = url.lower()
     
     if ".pdf" in lower_url:
-        text = await extract_text_from_pdf_url(url)
+        # Only the first REPORT_CONTEXT_CHARS reach the prompt; stop parsing there
+        text = await extract_text_from_pdf_url(url, max_chars=REPORT_CONTEXT_CHARS)
         return {"document_type": "pdf", "extracted_text": text}
     else:
         # Assume Image
-        # Download to temp file for MedVQA to read
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            image_bytes = resp.content
-            
-        import tempfile, os
-        fd, path = tempfile.mkstemp(suffix=".jpg") # MedVQA might expect extension
-        with os.fdopen(fd, 'wb') as tmp:
-            tmp.write(image_bytes)
-            
-        return {"document_type": "image", "local_image_path": path}
+        # MedVQA only accepts an http(s) image_url and fetches it server-side, so a local
+        # download + temp file would be written and deleted without ever being read
+        return {"document_type": "image"}
 
 async def analyze_document(state: AgentState):
     """
@@ -73,7 +71,7 @@ async def analyze_document(state: AgentState):
         # Text Context
         context = state.get("extracted_text", "")
         # Limit context size if needed? MedGemma has 8k context probably.
-        prompt = f"System: You are an expert medical AI. Analyze the following medical report text and answer the user's question.\n\n{context_prefix}Report Context:\n{context[:6000]}\n\nUser Question: {question}"
+        prompt = f"System: You are an expert medical AI. Analyze the following medical report text and answer the user's question.\n\n{context_prefix}Report Context:\n{context[:REPORT_CONTEXT_CHARS]}\n\nUser Question: {question}"
         
         response_text = await llm.answer_question(question=prompt, image_path=None)
         
@@ -91,11 +89,11 @@ async def analyze_document(state: AgentState):
              # Fallback or if for some reason we only have local path
              response_text = await llm.answer_question(question=final_question, image_path=path)
         
-        # Cleanup temp file? Maybe later or rely on OS cleanup
-        try:
-            import os
-            os.remove(path)
-        except: pass
+        # Cleanup temp file (only legacy callers pass a local path)
+        if path:
+            try:
+                os.remove(path)
+            except: pass
 
     return {"messages": [HumanMessage(content=response_text)]}
 
@@ -113,7 +111,9 @@ checkpointer = MemorySaver()
 
 app = workflow.compile(checkpointer=checkpointer)
 
-from app.agent.Tools.MemeoryTools import add_long_term_memory, get_long_term_memories
+async def _no_memories() -> list:
+    return []
+
 
 async def analyze_medical_document(user_id: str, document_url: str, question: str, appointment_id: str, db=None):
     """
@@ -121,22 +121,6 @@ async def analyze_medical_document(user_id: str, document_url: str, question: st
     or the final string.
     Saves the interaction to AppointmentChat.
     """
-    # Fetch Long Term Memories if DB is available
-    memories_str = ""
-    if db:
-        memories = await get_long_term_memories(user_id, db)
-        if memories:
-            memories_str = "\n".join([f"- {m}" for m in memories])
-
-    inputs = {
-        "messages": [HumanMessage(content=question)],
-        "document_url": document_url,
-        "document_type": "", # will be filled by load_document
-        "extracted_text": "",
-        "local_image_path": "",
-        "long_term_memories": memories_str
-    }
-    
     # Use appointment_id as thread_id to share context between doctor and patient
     thread_id = str(appointment_id) if appointment_id else user_id
     
@@ -146,25 +130,27 @@ async def analyze_medical_document(user_id: str, document_url: str, question: st
     # We run up to 'analyze_document' but we can't easily stream OUT of a node in a graph invoke.
     # So we will use the 'load_document' node logic, then manually call LLM streaming.
     
-    # 1. Load Document info first
-    # We can reuse the node function if we construct state manually, or just use the logic.
-    # Reusing the node function is cleaner but it expects state.
-    
+    # 1. Load Document info and Long Term Memories (if DB is available) concurrently;
+    # load_document only reads document_url, so it doesn't need the memories yet
     doc_state = {
         "document_url": document_url,
         "messages": [HumanMessage(content=question)],
-        "long_term_memories": memories_str
     }
     
-    # Execute load_document node logic
     try:
-        loaded_data = await load_document(doc_state)
+        memories, loaded_data = await asyncio.gather(
+            get_long_term_memories(user_id, db) if db else _no_memories(),
+            load_document(doc_state),
+        )
         doc_state.update(loaded_data)
     except Exception as e:
         logger.error(f"Error loading document: {e}")
-        yield f"Error loading document: {e}"
+        yield sse_event({'type': 'error', 'message': f"Error loading document: {e}"})
         return
 
+    memories_str = "\n".join([f"- {m}" for m in memories]) if memories else ""
+    doc_state["long_term_memories"] = memories_str
+
     # 2. Prepare Prompt (Logic from analyze_document node)
     llm = get_vqa_chain()
     context_prefix = ""
@@ -176,7 +162,7 @@ async def analyze_medical_document(user_id: str, document_url: str, question: st
     
     if doc_state.get("document_type") == "pdf":
         context = doc_state.get("extracted_text", "")
-        prompt = f"System: You are an expert medical AI. Analyze the following medical report text and answer the user's question.\n\n{context_prefix}Report Context:\n{context[:6000]}\n\nUser Question: {question}"
+        prompt = f"System: You are an expert medical AI. Analyze the following medical report text and answer the user's question.\n\n{context_prefix}Report Context:\n{context[:REPORT_CONTEXT_CHARS]}\n\nUser Question: {question}"
     else:
         # Image
         path = doc_state.get("local_image_path")
@@ -185,44 +171,59 @@ async def analyze_medical_document(user_id: str, document_url: str, question: st
         prompt = f"{context_prefix}Question: {question}"
 
     # 3. Stream LLM Response
-    full_response = ""
+    full_response_parts = []
     try:
-        import json
         async for chunk in llm.answer_question(question=prompt, image_path=image_path):
-            full_response += chunk
-            yield f"data: {json.dumps({'type': 'token', 'content': chunk})}\n\n"
+            full_response_parts.append(chunk)
+            yield sse_token(chunk)
         
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield sse_event({'type': 'done'})
     except Exception as e:
         logger.error(f"Streaming error: {e}")
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield sse_event({'type': 'error', 'message': str(e)})
         return
 
+    full_response = "".join(full_response_parts)
+
     # Cleanup temp file if needed
     if doc_state.get("local_image_path"):
         try:
-             import os
              os.remove(doc_state["local_image_path"])
         except: pass
 
-    # 4. Save to DB (AppointmentChat) & Long Term Memory
-    if db:
-        # Save memory?
-        lower_q = question.lower()
-        if lower_q.startswith("remember") or "save this info" in lower_q:
-             await add_long_term_memory(user_id, question, db)
+    # 4. Save to DB (AppointmentChat) & Long Term Memory.
+    # Runs after the stream closes so the client isn't held open on DB latency; it uses
+    # its own session because the request-scoped one may already be closed by then.
+    lower_q = question.lower()
+    remember = lower_q.startswith("remember") or "save this info" in lower_q
+    if db and (remember or appointment_id):
+        task = asyncio.create_task(
+            _save_interaction(user_id, question, full_response, document_url, appointment_id, remember)
+        )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
-        if appointment_id:
-            try:
-                from app.models.appointment_chat import AppointmentChat
-                chat_entry = AppointmentChat(
+
+# Strong references to fire-and-forget save tasks (the loop only keeps weak ones)
+_background_tasks: set = set()
+
+
+async def _save_interaction(
+    user_id: str, question: str, full_response: str, document_url: str, appointment_id: str, remember: bool
+):
+    try:
+        async with SessionLocal() as db:
+            if remember:
+                await add_long_term_memory(user_id, question, db)
+
+            if appointment_id:
+                db.add(AppointmentChat(
                     appointment_id=appointment_id,
                     user_id=user_id,
                     message=question,
                     response=full_response,
                     document_url=document_url
-                )
-                db.add(chat_entry)
+                ))
                 await db.commit()
-            except Exception as e:
-                logger.error(f"Failed to save chat history: {e}")
+    except Exception as e:
+        logger.error(f"Failed to save chat history: {e}")
@@ -1,26 +1,37 @@
 import json
-import httpx
+import hashlib
 from google import genai
 from google.genai import types
 from typing import List, Dict, Any
 from app.core.config import settings
+from app.utils.cache import TTLCache
+from app.utils.image import fetch_image
 
 # Configure Gemini client
 client = None
 if settings.GOOGLE_API_KEY:
     client = genai.Client(api_key=settings.GOOGLE_API_KEY)
 
+# Extraction results keyed by (image sha256, sorted keys): re-uploading the same form
+# with the same fields skips the Gemini call
+EXTRACTION_CACHE_TTL = 3600  # seconds
+EXTRACTION_CACHE_MAX = 256
+_extraction_cache = TTLCache(maxsize=EXTRACTION_CACHE_MAX, ttl=EXTRACTION_CACHE_TTL)
+
+
 async def populate_event_data(image_url: str, keys: List[str]) -> Dict[str, Any]:
     """
     Analyzes a form image and extracts values for the provided keys using Gemini 1.5.
     Returns a dictionary of key-value pairs.
     """
     try:
-        # 1. Download the image
-        async with httpx.AsyncClient() as client:
-            response = await client.get(image_url)
-            response.raise_for_status()
-            image_data = response.content
+        # 1. Download the image (served from the image cache on re-submits)
+        image_data = await fetch_image(image_url)
+
+        cache_key = (hashlib.sha256(image_data).hexdigest(), tuple(sorted(keys)))
+        hit = _extraction_cache.get(cache_key)
+        if hit is not None:
+            return dict(hit)
             
         # 2. Setup Gemini Model with structured output configuration
         model_name = settings.GENERAL_MODEL or "gemini-3-flash-preview"
@@ -49,7 +60,7 @@ Output Format:
             types.Part.from_bytes(data=image_data, mime_type="image/jpeg")
         ]
         
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=model_name,
             contents=contents,
             config=types.GenerateContentConfig(
@@ -59,7 +70,9 @@ Output Format:
         
         # 5. Parse and return JSON
         if response and response.text:
-            return json.loads(response.text)
+            result = json.loads(response.text)
+            _extraction_cache.set(cache_key, result)
+            return dict(result)
         else:
             return {key: None for key in keys}
             
@@ -5,13 +5,63 @@ WebSocket endpoint to receive audio, transcribe using remote HF Space.
 import io
 import logging
 import base64
-import wave
+import struct
 from app.agent.LLM.llm import get_medasr_chain
 
 logger = logging.getLogger(__name__)
 
 SAMPLE_RATE = 16000
 
+
+def _wav_header(n_bytes: int, sample_rate: int = SAMPLE_RATE, channels: int = 1, bits: int = 16) -> bytes:
+    """44-byte canonical RIFF/WAVE header for `n_bytes` of little-endian PCM."""
+    block_align = channels * bits // 8
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + n_bytes, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits,
+        b'data', n_bytes,
+    )
+
+
+class _WavStream:
+    """
+    Read-only file-like view of a WAV header followed by raw PCM.
+    httpx's multipart encoder reads it in 64 KiB chunks, so the PCM is uploaded
+    straight from the received buffer without building a `header + pcm` copy.
+    """
+
+    def __init__(self, pcm: bytes):
+        self._header = _wav_header(len(pcm))
+        self._pcm = memoryview(pcm)
+        self._size = len(self._header) + len(pcm)
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = min(max(base + offset, 0), self._size)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._size - self._pos
+        start, end = self._pos, min(self._pos + size, self._size)
+        header_len = len(self._header)
+        parts = []
+        if start < header_len:
+            parts.append(self._header[start:min(end, header_len)])
+        if end > header_len:
+            parts.append(self._pcm[max(start, header_len) - header_len:end - header_len])
+        self._pos = end
+        return b"".join(parts)
+
+
 async def transcribe_audio(audio_bytes: bytes) -> str:
     """
     Transcribe raw audio bytes (WAV / raw PCM) to text using Remote MedASR.
@@ -25,25 +75,15 @@ async def transcribe_audio(audio_bytes: bytes) -> str:
     # Simple check for RIFF header
     if not audio_bytes.startswith(b'RIFF'):
         # Assume Raw 16-bit PCM @ 16kHz
-        # Wrap in WAV header
-        try:
-            with io.BytesIO() as wav_io:
-                with wave.open(wav_io, 'wb') as wav_file:
-                    wav_file.setnchannels(1)
-                    wav_file.setsampwidth(2) # 16-bit
-                    wav_file.setframerate(SAMPLE_RATE)
-                    wav_file.writeframes(audio_bytes)
-                final_wav_bytes = wav_io.getvalue()
-        except Exception as e:
-            logger.error(f"Failed to wrap PCM in WAV: {e}")
-            return ""
+        # Stream a WAV header followed by the PCM (no concatenated copy)
+        final_wav_bytes = _WavStream(audio_bytes)
 
     if len(final_wav_bytes) < 100:
         return ""
 
     # ─── 2. Call Remote API (File Upload) ───
     try:
-        # Pass bytes directly, llm.py handles multipart upload
+        # Bytes or the WAV stream; llm.py handles the multipart upload
         return await medasr.transcribe(final_wav_bytes, filename="speech.wav")
     except Exception as e:
         logger.error(f"Remote transcription error: {e}")
@@ -9,10 +9,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
 from app.api import deps
-from app.models.user import User
+from app.models.user import User, UserRole
 from app.agent.summarizeAgent import create_appointment_suggestion
 from app.agent.Basemodels.summarizeModel import AppointmentSummary
-from app.utils.voice_trigger import trigger_call
+from app.utils.voice_trigger import trigger_call_once
 
 router = APIRouter()
 
@@ -78,9 +78,11 @@ class DocAnalysisRequest(BaseModel):
 from app.agent.docAgent import analyze_medical_document
 from typing import List
 from app.models.appointment_chat import ChatResponse, AppointmentChat
-from sqlalchemy import select
+from app.models.appointment import Appointment
+from app.models.patient import Patient
+from sqlalchemy import select, or_, true, false
 
-from fastapi.responses import StreamingResponse
+from app.utils.sse import coalesce_partials, sse_response
 
 @router.post("/analyze")
 async def analyze_report(
@@ -99,10 +101,18 @@ async def analyze_report(
             appointment_id=request.appointment_id,
             db=db
         )
-        return StreamingResponse(stream, media_type="text/event-stream")
+        return sse_response(stream)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Roles that may read any appointment's chat history; everyone else only their own
+CHAT_HISTORY_STAFF_ROLES = {
+    UserRole.DOCTOR.value,
+    UserRole.NURSE.value,
+    UserRole.HOSPITAL_ADMIN.value,
+    UserRole.SUPER_ADMIN.value,
+}
+
 @router.get("/appointments/{appointment_id}/chat", response_model=List[ChatResponse])
 async def get_appointment_chat_history(
     appointment_id: str,
@@ -112,11 +122,19 @@ async def get_appointment_chat_history(
     """
     Get chat history for a specific appointment.
     """
-    # Authorization check: User must be related to appointment (patient) or be a doctor (or admin)
-    # Ideally should check appointment ownership. For now, assuming basic access.
-    
-    query = select(AppointmentChat).where(AppointmentChat.appointment_id == appointment_id).order_by(AppointmentChat.created_at)
-    result = await db.execute(query)
+    # Authorization: the appointment's own patient, or a whitelisted staff role. Both are
+    # checked in the same query as the fetch, not with a separate lookup.
+    is_staff = true() if current_user.role in CHAT_HISTORY_STAFF_ROLES else false()
+    query = (
+        select(AppointmentChat)
+        .join(Appointment, Appointment.id == AppointmentChat.appointment_id)
+        .outerjoin(Patient, Patient.id == Appointment.patient_id)
+        .where(
+            AppointmentChat.appointment_id == appointment_id,
+            or_(Patient.user_id == current_user.id, is_staff),
+        )
+    )
+    result = await db.execute(query.order_by(AppointmentChat.created_at))
     chats = result.scalars().all()
     return chats
 
@@ -133,7 +151,8 @@ async def trigger_outbound_call(
     current_user: User = Depends(deps.get_current_active_user),
 ):
     try:
-        await trigger_call(request.phone_number, request.appointment_id, request.doctor_prompt)
+        # Repeats of a call that was just placed get the same answer without dialing again
+        await trigger_call_once(current_user.id, request.phone_number, request.appointment_id, request.doctor_prompt)
         return {"message": f"Call initiated to {request.phone_number}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -194,7 +213,7 @@ async def deep_research_endpoint(
             vision_prompt=request.vision_prompt
         )
         # Using text/event-stream for SSE compatibility
-        return StreamingResponse(stream, media_type="text/event-stream")
+        return sse_response(stream)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -205,8 +224,8 @@ class ExpertCheckRequest(BaseModel):
     medication: List[str] = []
     lab_test: List[str] = []
 
-from app.agent.ExpAgent import upsert_check, retrieve_checks
-import uuid
+from app.agent.ExpAgent import upsert_check, upsert_checks_bulk, retrieve_checks
+from app.utils.uuid_pool import new_uuid
 
 @router.post("/expert-check")
 async def add_expert_check(
@@ -222,7 +241,7 @@ async def add_expert_check(
         if not hospital_id:
              raise HTTPException(status_code=400, detail="Hospital ID required")
 
-        check_id = str(uuid.uuid4())
+        check_id = new_uuid()
         
         # Convert lists to strings for embedding/metadata
         medication_str = ", ".join(request.medication) if request.medication else ""
@@ -244,6 +263,53 @@ async def add_expert_check(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class BatchExpertCheckRequest(BaseModel):
+    items: List[ExpertCheckRequest]
+
+# One Pinecone upsert per batch; keeps the request well under its 2 MB limit
+MAX_EXPERT_CHECK_BATCH = 100
+
+@router.post("/expert-check/batch")
+async def add_expert_checks_batch(
+    request: BatchExpertCheckRequest,
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    Store several expert insights/checks at once: one embedding pass and one Pinecone upsert.
+    Returns the upsert result plus the ids assigned to the stored checks, in request order.
+    """
+    if len(request.items) > MAX_EXPERT_CHECK_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_EXPERT_CHECK_BATCH} checks per batch")
+
+    try:
+        items = []
+        for check in request.items:
+            if not check.check_text.strip():
+                continue
+            hospital_id = check.hospital_id or current_user.hospital_id
+            if not hospital_id:
+                raise HTTPException(status_code=400, detail="Hospital ID required")
+            items.append({
+                "check_id": new_uuid(),
+                "check_text": check.check_text,
+                "category": check.category,
+                "hospital_id": hospital_id,
+                "medication": ", ".join(check.medication),
+                "lab_test": ", ".join(check.lab_test)
+            })
+        if not items:
+            raise HTTPException(status_code=400, detail="No checks with text to store")
+
+        result = await upsert_checks_bulk(items)
+        if result.get("status") == "error":
+            raise HTTPException(status_code=500, detail=result.get("message"))
+
+        return {**result, "ids": [item["check_id"] for item in items]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/expert-check", response_model=List[dict])
 async def search_expert_checks(
     query: str,
@@ -264,7 +330,11 @@ async def search_expert_checks(
             user_hospital_id=hospital_id, # Must match
             category=category
         )
-        return results
+        if isinstance(results, dict):
+            raise HTTPException(status_code=500, detail=results.get("message"))
+        return [match.to_dict() for match in results]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -279,12 +349,15 @@ from app.agent.ExpAgent import stream_expert_answer
 @router.post("/expert-chat")
 async def expert_chat_endpoint(
     request: ExpertChatRequest,
+    coalesce: bool = False,
     current_user: User = Depends(deps.get_current_active_user),
 ):
     """
     Stream an expert medical answer based on the knowledge base.
     Uses GENERAL_MODEL + Pinecone Context.
     Returns: Server-Sent Events (SSE).
+    With `?coalesce=1`, token frames are replaced by at most one
+    {"type": "partial", "content": <answer so far>} frame every 20 ms.
     """
     # 1. Determine Hospital ID and Filtering Logic
     if request.hospital_id:
@@ -311,7 +384,9 @@ async def expert_chat_endpoint(
             category=request.category,
             strict_hospital=strict_mode
         )
-        return StreamingResponse(stream, media_type="text/event-stream")
+        if coalesce:
+            stream = coalesce_partials(stream)
+        return sse_response(stream)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -340,7 +415,7 @@ async def diet_planner_endpoint(
             doctor_remarks=request.doctor_remarks,
             db=db
         )
-        return StreamingResponse(stream, media_type="text/event-stream")
+        return sse_response(stream)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -384,6 +459,7 @@ from app.agent.medicalSummarizer import stream_medical_summary
 @router.post("/summarize-medical-report")
 async def summarize_medical_report_endpoint(
     request: MedicalSummarizeRequest,
+    coalesce: bool = False,
     current_user: User = Depends(deps.get_current_active_user),
 ):
     """
@@ -392,13 +468,17 @@ async def summarize_medical_report_endpoint(
     - **Skin Specialist** (use_skin_specialist=true): Dermatology images — analyzed by
       MedGemma + Indian Skin LoRA (Fitzpatrick III-VI, tropical conditions).
     Returns: Server-Sent Events (SSE).
+    With `?coalesce=1`, token frames are replaced by at most one
+    {"type": "partial", "content": <summary so far>} frame every 20 ms.
     """
     try:
         stream = stream_medical_summary(
             image_url=request.image_url,
             use_skin_specialist=request.use_skin_specialist
         )
-        return StreamingResponse(stream, media_type="text/event-stream")
+        if coalesce:
+            stream = coalesce_partials(stream)
+        return sse_response(stream)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -419,12 +499,11 @@ async def hear_embed_endpoint(
     Returns: {"embeddings": [...], "dim": int}
     Useful for downstream acoustic anomaly detection or similarity search.
     """
-    import httpx as _httpx
+    from app.utils.http_client import get_http_client, DOWNLOAD_TIMEOUT
     try:
-        async with _httpx.AsyncClient() as client:
-            resp = await client.get(request.audio_url)
-            resp.raise_for_status()
-            audio_bytes = resp.content
+        resp = await get_http_client().get(request.audio_url, timeout=DOWNLOAD_TIMEOUT)
+        resp.raise_for_status()
+        audio_bytes = resp.content
 
         hear = get_hear_model()
         embedding = await hear.embed(audio_bytes, filename="patient_audio.wav")
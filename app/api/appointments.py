@@ -1,21 +1,27 @@
 from typing import Any, List, Optional
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.api import deps
 from app.crud.appointment import appointment as crud_appointment
 from app.schemas.appointment import Appointment, AppointmentCreate, AppointmentUpdate, AppointmentWithDoctor, AppointmentRemarks
 from app.models.user import User
+from app.models.patient import Patient as PatientModel
+from app.models.appointment import Appointment as AppointmentModel
 from app.crud.patient import patient as crud_patient
 from app.crud.doctor import doctor as crud_doctor
 from app.models.user import UserRole
 from app.schemas.hospital import Hospital
 from datetime import date
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from app.schemas.appointment_vital import AppointmentVitalCreate, AppointmentVitalResponse, AppointmentVitalInput
 from app.crud.appointment_vital import appointment_vital as crud_appointment_vital
 
 router = APIRouter()
 
+_APPOINTMENT_LIST_ADAPTER = TypeAdapter(List[AppointmentWithDoctor])
+_APPOINTMENT_COLUMNS = tuple(c.key for c in AppointmentModel.__table__.columns)
+
 @router.post("/{id}/consultation", response_model=Appointment)
 async def consultation_update(
     *,
@@ -99,11 +105,15 @@ async def add_vitals(
     
     # Auto-assign nurse to appointment if not already assigned
     if not appointment.nurse_id:
-        # We know current_user is a NURSE (checked above)
-        appointment.nurse_id = current_user.id
-        db.add(appointment)
+        # We know current_user is a NURSE (checked above).
+        # Guarded on nurse_id IS NULL so a concurrent assignment is never overwritten.
+        await db.execute(
+            update(AppointmentModel)
+            .where(AppointmentModel.id == id, AppointmentModel.nurse_id.is_(None))
+            .values(nurse_id=current_user.id)
+            .execution_options(synchronize_session=False)
+        )
         await db.commit()
-        await db.refresh(appointment)
         
     return new_vital
     
@@ -112,6 +122,7 @@ async def get_vitals(
     id: str,
     db: AsyncSession = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Get all vitals for an appointment.
@@ -124,8 +135,6 @@ async def get_vitals(
     # Check access (Patient, Doctor, Nurse, Admin)
     # If patient, ensure it's their appointment
     if current_user.role == UserRole.PATIENT:
-        from app.crud.patient import patient as crud_patient
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
         if not patient_profile or appointment.patient_id != patient_profile.id:
              raise HTTPException(status_code=403, detail="Not authorized")
 
@@ -146,26 +155,26 @@ async def assign_nurse_to_appointment(
     if current_user.role not in [UserRole.DOCTOR.value, UserRole.HOSPITAL_ADMIN.value, UserRole.SUPER_ADMIN.value]:
          raise HTTPException(status_code=403, detail="Not authorized to assign nurses")
 
-    # 2. Get Appointment
-    appointment = await crud_appointment.get(db, id=id)
-    if not appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+    from sqlalchemy import select
 
-    # 3. Verify Nurse
-    from app.crud.user import user as crud_user
-    nurse = await crud_user.get(db, id=nurse_id) # Using User ID for now as Nurse ID usually == User ID in simplistic model or we need to find Nurse profile.
-    # Implementation Plan assumption: nurse_id refers to User ID with role 'nurse' or Nurse profile ID.
-    # Given `patient.assigned_nurse_id` often refers to User ID in this codebase, I will Stick to User Level ID for simplicity or check if Nurse table is used.
-    # Checking `models/user.py`, `Nurse` is a profile. But `Patient.assigned_nurse_id` likely stores the UUID.
-    # Let's assume User ID for now as `nurse = relationship("User")` in models.
-    
-    if not nurse:
+    # 2. Verify Nurse
+    # nurse_id is the nurse's User ID (Appointment.nurse is a relationship to User)
+    if await db.scalar(select(User.id).where(User.id == nurse_id)) is None:
          raise HTTPException(status_code=404, detail="Nurse not found")
 
-    appointment.nurse_id = nurse_id
-    db.add(appointment)
+    # 3. Assign in one statement; RETURNING hands back the updated row
+    stmt = (
+        update(AppointmentModel)
+        .where(AppointmentModel.id == id)
+        .values(nurse_id=nurse_id)
+        .returning(AppointmentModel)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    appointment = result.scalar_one_or_none()
+    if not appointment:
+        raise HTTPException(status_code=404, detail="Appointment not found")
     await db.commit()
-    await db.refresh(appointment)
     return appointment
 
 @router.get("/nurse/assigned", response_model=List[AppointmentWithDoctor])
@@ -183,18 +192,11 @@ async def read_appointments_for_nurse(
     # We need a crud method for this or use get_multi with filter if available.
     # Adding simplified query here or using crud method.
     from sqlalchemy import select
-    from sqlalchemy.orm import selectinload
     from app.models.appointment import Appointment as AppointmentModel
-    from app.models.doctor import Doctor
-    from app.models.patient import Patient
+    from app.crud.appointment import appointment_list_options
     
-    # Include nurse relationship so _map_appointments can find the name
-    query = select(AppointmentModel).options(
-        selectinload(AppointmentModel.doctor).selectinload(Doctor.user),
-        selectinload(AppointmentModel.doctor).selectinload(Doctor.hospital),
-        selectinload(AppointmentModel.nurse),
-        selectinload(AppointmentModel.patient)
-    ).filter(AppointmentModel.nurse_id == current_user.id).order_by(AppointmentModel.date.desc(), AppointmentModel.slot)
+    # Load every relationship _map_appointments reads (incl. nurse for the name) up front
+    query = select(AppointmentModel).options(*appointment_list_options()).filter(AppointmentModel.nurse_id == current_user.id).order_by(AppointmentModel.date.desc(), AppointmentModel.slot)
     
     result = await db.execute(query)
     appointments = result.scalars().all()
@@ -207,6 +209,7 @@ async def create_appointment(
     db: AsyncSession = Depends(deps.get_db),
     appointment_in: AppointmentCreate,
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Create a new appointment.
@@ -214,13 +217,10 @@ async def create_appointment(
     - **Patients**: Can create appointments for themselves.
     - **Admins**: Can create appointments for anyone.
     """
-    from app.crud.patient import patient as crud_patient
     from app.models.user import UserRole
 
     # If user is a patient, ensure they are booking for themselves
     if current_user.role == UserRole.PATIENT:
-        # Get patient profile for current user
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
         if not patient_profile:
              raise HTTPException(status_code=400, detail="Patient profile not found for this user.")
         
@@ -240,6 +240,7 @@ async def read_patient_appointments(
     db: AsyncSession = Depends(deps.get_db),
     patient_id: str,
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Get all appointments for a specific patient.
@@ -247,15 +248,11 @@ async def read_patient_appointments(
     - Returns appointment details + doctor name/specialization.
     - **Patients**: Can only view their own appointments.
     """
-    from app.crud.patient import patient as crud_patient
     from app.models.user import UserRole
     from app.schemas.hospital import Hospital
     
-    # Ownership check
     # Ownership check
     if current_user.role == UserRole.PATIENT:
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
-        
         if not patient_profile:
              raise HTTPException(status_code=403, detail="No patient profile found for this user")
 
@@ -276,17 +273,16 @@ async def read_patient_appointments(
 async def read_my_appointments(
     db: AsyncSession = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Get all appointments for the current logged-in patient.
     """
-    from app.crud.patient import patient as crud_patient
     from app.models.user import UserRole
     
     if current_user.role != UserRole.PATIENT:
          raise HTTPException(status_code=400, detail="Only patients can access this endpoint")
          
-    patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
     if not patient_profile:
         raise HTTPException(status_code=404, detail="Patient profile not found for current user")
         
@@ -294,51 +290,34 @@ async def read_my_appointments(
     return await _map_appointments(appointments)
 
 async def _map_appointments(appointments):
-    
-    # Map to schema with doctor details
-    result = []
+    """
+    Maps loaded appointments to AppointmentWithDoctor, adding doctor / hospital / nurse details.
+    Rows are flattened to dicts first and validated in one pass through a shared TypeAdapter.
+    """
+    rows = []
     for appt in appointments:
         doctor_name = "Unknown"
         doctor_spec = None
-        hospital_name = None
         hospital_obj = None
         
         if appt.doctor:
             if appt.doctor.user:
                 doctor_name = appt.doctor.user.full_name
             doctor_spec = appt.doctor.specialization
-            if appt.doctor.hospital:
-                hospital_name = appt.doctor.hospital.name
-                hospital_obj = appt.doctor.hospital
-                
-        # Create response object
-        appt_dict = AppointmentWithDoctor.model_validate(appt)
-        
-        # Populate flat fields
-        appt_dict.doctor_name = doctor_name
-        appt_dict.doctor_specialization = doctor_spec
-        appt_dict.hospital_name = hospital_name
+            hospital_obj = appt.doctor.hospital
+
+        # Column values plus the relationships the callers eager-load (appointment_list_options)
+        row = {key: getattr(appt, key) for key in _APPOINTMENT_COLUMNS}
+        row["doctor"] = appt.doctor
+        row["patient"] = appt.patient
+        row["doctor_name"] = doctor_name
+        row["doctor_specialization"] = doctor_spec
+        row["hospital_name"] = hospital_obj.name if hospital_obj else None
+        row["hospital"] = hospital_obj
+        row["nurse_name"] = appt.nurse.full_name if appt.nurse else None
+        rows.append(row)
         
-        # Populate nested objects
-        # doctor should be populated automatically by model_validate from appt.doctor relationship
-        # hospital needs manual assignment from appt.doctor.hospital
-        if hospital_obj:
-            appt_dict.hospital = Hospital.model_validate(hospital_obj)
-
-        # Populate nurse_name if available (e.g. eagerly loaded or just present)
-        # Note: appt.nurse might be loaded if we added selectinload(Appointment.nurse) 
-        # in the query calling this.
-        if hasattr(appt, 'nurse') and appt.nurse:
-             appt_dict.nurse_name = appt.nurse.full_name
-
-        if hasattr(appt, 'patient') and appt.patient:
-             from app.schemas.patient import Patient
-             appt_dict.patient = Patient.model_validate(appt.patient)
-
-            
-        result.append(appt_dict)
-        
-    return result
+    return _APPOINTMENT_LIST_ADAPTER.validate_python(rows, from_attributes=True)
         
 @router.get("/search", response_model=List[AppointmentWithDoctor])
 async def search_appointments(
@@ -353,32 +332,32 @@ async def search_appointments(
     - **patient_id**: Can be Patient Profile ID or User ID.
     - **doctor_id**: Doctor Profile ID.
     """
-    from app.crud.patient import patient as crud_patient
+    from sqlalchemy import select, or_
     from app.models.user import UserRole
     
-    # Resolve Patient ID if User ID is provided
-    # Check if patient_id looks like a UUID (it should be)
-    # but we can try to find patient by user_id first if it's not a direct match
-    target_patient_id = patient_id
+    is_patient = current_user.role == UserRole.PATIENT
     
-    # Try to find patient profile by ID first
-    patient_profile = await crud_patient.get(db, id=patient_id)
-    if not patient_profile:
-        # If not found by ID, maybe it's a User ID?
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=patient_id)
-        if patient_profile:
-            target_patient_id = patient_profile.id
-        else:
-             # If still not found, and it was meant to be a patient_id, then it's invalid.
-             # But let's proceed with original ID if we can't resolve it, effectively returning empty list or error later if strict.
-             # For now, if we can't resolve it to a profile and it wasn't a profile ID, we might return empty.
-             pass
+    # One query resolves patient_id (as a Patient ID or a User ID) and, for patients,
+    # the caller's own profile
+    conditions = [PatientModel.id == patient_id, PatientModel.user_id == patient_id]
+    if is_patient:
+        conditions.append(PatientModel.user_id == current_user.id)
+    result = await db.execute(select(PatientModel).where(or_(*conditions)))
+    profiles = result.scalars().all()
+    by_id = {p.id: p for p in profiles}
+    by_user_id = {p.user_id: p for p in profiles}
+    
+    # Prefer a direct profile ID match, then a User ID match; otherwise keep the
+    # original ID, which simply matches no appointments
+    target_patient_id = patient_id
+    if patient_id not in by_id and patient_id in by_user_id:
+        target_patient_id = by_user_id[patient_id].id
 
     # Authorization Check
     # Patient can only search for themselves
-    if current_user.role == UserRole.PATIENT:
-        current_patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
-        if not current_patient_profile or current_patient_profile.id != target_patient_id:
+    if is_patient:
+        caller_profile = by_user_id.get(current_user.id)
+        if not caller_profile or caller_profile.id != target_patient_id:
              raise HTTPException(status_code=403, detail="Not authorized to view these appointments")
     
     # Doctor/Nurse/Admin can search for any patient
@@ -396,6 +375,7 @@ async def read_appointments(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Get list of appointments filtered by user role and hospital.
@@ -423,8 +403,6 @@ async def read_appointments(
         else:
              query = query.filter(AppointmentModel.id == "0")
     elif current_user.role == UserRole.PATIENT.value:
-        from app.crud.patient import patient as crud_patient
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
         if patient_profile:
             query = query.filter(AppointmentModel.patient_id == patient_profile.id)
         else:
@@ -442,20 +420,24 @@ async def read_appointment(
     db: AsyncSession = Depends(deps.get_db),
     id: str,
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Get appointment details by ID.
     """
     # Use custom query to load relations (Doctor, Nurse)
     from sqlalchemy import select
-    from sqlalchemy.orm import selectinload
+    from sqlalchemy.orm import raiseload, selectinload
     from app.models.doctor import Doctor
     from app.models.appointment import Appointment as AppointmentModel
+    from app.models.appointment_vital import AppointmentVital
     
     query = select(AppointmentModel).options(
         selectinload(AppointmentModel.doctor).selectinload(Doctor.user),
         selectinload(AppointmentModel.doctor).selectinload(Doctor.hospital),
-        selectinload(AppointmentModel.nurse)
+        selectinload(AppointmentModel.nurse),
+        selectinload(AppointmentModel.vital_logs).selectinload(AppointmentVital.nurse),
+        raiseload("*")
     ).filter(AppointmentModel.id == id)
     result = await db.execute(query)
     appointment = result.scalars().first()
@@ -471,14 +453,12 @@ async def read_appointment(
     
     # Check access for patient
     from app.models.user import UserRole
-    from app.crud.patient import patient as crud_patient
     if current_user.role == UserRole.PATIENT:
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
         if not patient_profile or appointment.patient_id != patient_profile.id:
              raise HTTPException(status_code=403, detail="Not authorized")
 
-    # Populate vitals for consistency
-    appointment.vitals = await crud_appointment_vital.get_by_appointment(db, appointment_id=id)
+    # Populate vitals for consistency (loaded with the appointment, newest first)
+    appointment.vitals = appointment.vital_logs
 
     return appointment
 
@@ -489,6 +469,7 @@ async def update_appointment(
     id: str,
     appointment_in: AppointmentUpdate,
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Update appointment.
@@ -499,9 +480,7 @@ async def update_appointment(
     
     # Check access for patient
     from app.models.user import UserRole
-    from app.crud.patient import patient as crud_patient
     if current_user.role == UserRole.PATIENT:
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
         if not patient_profile or appointment.patient_id != patient_profile.id:
              raise HTTPException(status_code=403, detail="Not authorized to edit this appointment")
 
@@ -514,6 +493,7 @@ async def delete_appointment(
     db: AsyncSession = Depends(deps.get_db),
     id: str,
     current_user: User = Depends(deps.get_current_active_user),
+    patient_profile: Optional[PatientModel] = Depends(deps.get_current_patient_profile),
 ) -> Any:
     """
     Cancel/delete appointment.
@@ -524,9 +504,7 @@ async def delete_appointment(
     
     # Check access for patient
     from app.models.user import UserRole
-    from app.crud.patient import patient as crud_patient
     if current_user.role == UserRole.PATIENT:
-        patient_profile = await crud_patient.get_by_user_id(db, user_id=current_user.id)
         if not patient_profile or appointment.patient_id != patient_profile.id:
              raise HTTPException(status_code=403, detail="Not authorized to cancel this appointment")
 
@@ -65,16 +65,16 @@ async def register_user(
     - If hospital is provided, user becomes hospital admin
     - Returns the created user object
     """
-    user = await crud_user.get_by_email(db, email=user_in.email)
-    if user:
-        raise HTTPException(
-            status_code=400,
-            detail="The user with this username already exists in the system",
-        )
-    
     # Optional logic: create hospital if provided, but typically register is just for user or with existing hospital
     # For now simplicity: just create user. If hospital_id is in user_in, it links.
     if hospital_in:
+        # Reject a taken email before creating the hospital so it isn't orphaned;
+        # the insert below stays the authoritative (atomic) check
+        if await crud_user.get_by_email(db, email=user_in.email):
+            raise HTTPException(
+                status_code=400,
+                detail="The user with this username already exists in the system",
+            )
         # Create Hospital
         hospital = await crud_hospital.create(db, obj_in=hospital_in)
         
@@ -90,7 +90,13 @@ async def register_user(
         user_in.role = UserRole.BASE
         user_in.hospital_id = None
         
-    user = await crud_user.create(db, obj_in=user_in)
+    # Check-and-insert in one statement, so concurrent sign-ups can't both pass
+    user = await crud_user.create_if_absent(db, obj_in=user_in)
+    if not user:
+        raise HTTPException(
+            status_code=400,
+            detail="The user with this username already exists in the system",
+        )
     return user
 
 @router.get("/login/google")
@@ -146,13 +152,16 @@ async def auth_google_callback(
         user_in = UserCreate(
             email=email,
             full_name=user_info.get("name"),
-            password=security.get_password_hash("123456789N"), # Dummy password
+            password="", # Never used: stored as UNUSABLE_PASSWORD below
             is_active=True,
             is_verified=True,
             role="base", # Default role as requested
             image=user_info.get("picture")
         )
-        user = await crud_user.create(db, obj_in=user_in)
+        # A concurrent first login may have created it in the meantime
+        user = await crud_user.create_if_absent(
+            db, obj_in=user_in, hashed_password=security.UNUSABLE_PASSWORD
+        ) or await crud_user.get_by_email(db, email=email)
     
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -172,6 +181,13 @@ async def auth_google_callback(
 
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
+import requests
+from cachecontrol import CacheControl
+
+# Shared transport for ID-token verification. Google serves its signing certs with a
+# multi-hour Cache-Control max-age, so CacheControl answers most fetches from memory
+# and verification becomes crypto-only.
+_google_request = google_requests.Request(session=CacheControl(requests.Session()))
 
 @router.post("/google", response_model=Token)
 async def google_auth_mobile(
@@ -196,7 +212,7 @@ async def google_auth_mobile(
         CLIENT_ID = "994195201263-nl156b5t0elh72k9v4lho8mfrg7sv2lj.apps.googleusercontent.com"
         idinfo = id_token.verify_oauth2_token(
             token,
-            google_requests.Request(),
+            _google_request,
             CLIENT_ID
         )
 
@@ -214,13 +230,16 @@ async def google_auth_mobile(
             user_in = UserCreate(
                 email=email,
                 full_name=name,
-                password=security.get_password_hash("123456789N"), # Dummy password
+                password="", # Never used: stored as UNUSABLE_PASSWORD below
                 is_active=True,
                 is_verified=True,
                 role="base", # Default role
                 image=picture
             )
-            user = await crud_user.create(db, obj_in=user_in)
+            # A concurrent first login may have created it in the meantime
+            user = await crud_user.create_if_absent(
+                db, obj_in=user_in, hashed_password=security.UNUSABLE_PASSWORD
+            ) or await crud_user.get_by_email(db, email=email)
         
         if not user.is_active:
             raise HTTPException(status_code=400, detail="Inactive user")
@@ -8,6 +8,8 @@ from app.core import security
 from app.core.config import settings
 from app.core.database import get_db
 from app.crud.user import user as crud_user
+from app.crud.patient import patient as crud_patient
+from app.models.patient import Patient
 from app.models.user import User, UserRole
 from app.schemas.auth import TokenPayload
 
@@ -40,6 +42,19 @@ def get_current_active_user(
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_patient_profile(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+) -> Optional[Patient]:
+    """
+    Patient profile of the caller, or None for other roles / users without one.
+    FastAPI caches dependencies per request, so handlers and their sub-dependencies
+    share a single lookup.
+    """
+    if current_user.role != UserRole.PATIENT.value:
+        return None
+    return await crud_patient.get_by_user_id(db, user_id=current_user.id)
+
 def get_current_active_superuser(
     current_user: User = Depends(get_current_user),
 ) -> User:
@@ -47,7 +47,7 @@ async def read_doctor_followups_today(
     Get follow-up appointments scheduled for today.
     """
     from datetime import date
-    from sqlalchemy.orm import selectinload
+    from app.crud.appointment import appointment_list_options
     from app.schemas.appointment import AppointmentWithDoctor
     
     # 1. Verify Doctor
@@ -58,12 +58,7 @@ async def read_doctor_followups_today(
     # 2. Query for appointments with follow_up_date == today
     today = date.today()
     
-    query = select(Appointment).options(
-        selectinload(Appointment.patient),
-        selectinload(Appointment.doctor).selectinload(Doctor.user),
-        selectinload(Appointment.doctor).selectinload(Doctor.hospital),
-        selectinload(Appointment.nurse)
-    ).filter(
+    query = select(Appointment).options(*appointment_list_options()).filter(
         Appointment.doctor_id == doctor_profile.id,
         Appointment.next_followup == today
     )
@@ -45,6 +45,7 @@ class Settings(BaseSettings):
     TAVILY_API_KEY: str = ""
     GROQ_API_KEY: str = ""
     PINECONE_API_KEY: str = ""
+    EMBED_CACHE_PATH: str = "./embed_cache.db"
     
     FIRST_SUPERUSER: EmailStr = "admin@example.com"
     FIRST_SUPERUSER_PASSWORD: str = "adminpassword"
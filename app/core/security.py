@@ -1,4 +1,7 @@
+import base64
+import hmac
 import bcrypt
+import orjson
 from datetime import datetime, timedelta, timezone
 from typing import Any, Union
 from jose import jwt
@@ -6,17 +9,43 @@ from app.core.config import settings
 
 ALGORITHM = settings.ALGORITHM
 
+# HS256 tokens are signed by hand: the header segment never changes and the keyed
+# HMAC state is built once and copied per token (OpenSSL-backed, so SHA-NI where available).
+# Other algorithms go through jose.
+_HS256_HEADER = base64.urlsafe_b64encode(orjson.dumps({"alg": "HS256", "typ": "JWT"})).rstrip(b"=")
+_HS256_MAC = hmac.new(settings.SECRET_KEY.encode("utf-8"), digestmod="sha256") if ALGORITHM == "HS256" else None
+
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _encode_hs256(claims: dict) -> str:
+    signing_input = _HS256_HEADER + b"." + _b64url(orjson.dumps(claims))
+    mac = _HS256_MAC.copy()
+    mac.update(signing_input)
+    return (signing_input + b"." + _b64url(mac.digest())).decode("ascii")
+
 def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
+    if _HS256_MAC is not None:
+        return _encode_hs256({"exp": int(expire.timestamp()), "sub": str(subject)})
+
     to_encode = {"exp": expire, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Stored as hashed_password for accounts that never log in with a password (OAuth sign-ups).
+# It is not a bcrypt hash, so no password can ever match it.
+UNUSABLE_PASSWORD = "!"
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
+    if not hashed_password or hashed_password == UNUSABLE_PASSWORD:
+        return False
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password: str) -> str:
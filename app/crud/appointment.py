@@ -1,22 +1,35 @@
 from typing import Any, List
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload, selectinload
 from app.crud.base import CRUDBase
 from app.models.appointment import Appointment
+from app.models.doctor import Doctor
 from app.schemas.appointment import AppointmentCreate, AppointmentUpdate
 
+
+def appointment_list_options() -> tuple:
+    """
+    Loader options for every relationship the appointment list responses read
+    (doctor -> user / hospital, nurse, patient). Each is fetched with one SELECT ... IN
+    for the whole result, instead of a lazy load per row.
+    Any other Appointment relationship raises on access, so a response that starts
+    reading a new relationship fails loudly instead of quietly adding N queries.
+    """
+    return (
+        selectinload(Appointment.doctor).selectinload(Doctor.user),
+        selectinload(Appointment.doctor).selectinload(Doctor.hospital),
+        selectinload(Appointment.nurse),
+        selectinload(Appointment.patient),
+        raiseload("*"),
+    )
+
+
 class CRUDAppointment(CRUDBase[Appointment, AppointmentCreate, AppointmentUpdate]):
     async def get_by_patient(
         self, db: AsyncSession, *, patient_id: str
     ) -> list[Appointment]:
-        from sqlalchemy import select
-        from sqlalchemy.orm import selectinload, joinedload
-        from app.models.doctor import Doctor
-        
-        query = select(Appointment).options(
-            selectinload(Appointment.doctor).selectinload(Doctor.user),
-            selectinload(Appointment.doctor).selectinload(Doctor.hospital),
-            selectinload(Appointment.nurse)
-        ).filter(
+        query = select(Appointment).options(*appointment_list_options()).filter(
             Appointment.patient_id == patient_id
         ).order_by(Appointment.date.desc(), Appointment.slot.asc())
         
@@ -26,7 +39,6 @@ class CRUDAppointment(CRUDBase[Appointment, AppointmentCreate, AppointmentUpdate
     async def get_by_doctor_date(
         self, db: AsyncSession, *, doctor_id: str, date: Any
     ) -> list[Appointment]:
-        from sqlalchemy import select
         # Cast date to ensure comparison works
         query = select(Appointment).filter(
             Appointment.doctor_id == doctor_id,
@@ -38,15 +50,7 @@ class CRUDAppointment(CRUDBase[Appointment, AppointmentCreate, AppointmentUpdate
     async def get_by_patient_and_doctor(
         self, db: AsyncSession, *, patient_id: str, doctor_id: str
     ) -> list[Appointment]:
-        from sqlalchemy import select
-        from sqlalchemy.orm import selectinload
-        from app.models.doctor import Doctor
-        
-        query = select(Appointment).options(
-            selectinload(Appointment.doctor).selectinload(Doctor.user),
-            selectinload(Appointment.doctor).selectinload(Doctor.hospital),
-            selectinload(Appointment.nurse)
-        ).filter(
+        query = select(Appointment).options(*appointment_list_options()).filter(
             Appointment.patient_id == patient_id,
             Appointment.doctor_id == doctor_id
         ).order_by(Appointment.date.desc(), Appointment.slot.desc())
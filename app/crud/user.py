@@ -11,7 +11,7 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         result = await db.execute(select(User).filter(User.email == email))
         return result.scalars().first()
 
-    async def create(self, db: AsyncSession, *, obj_in: UserCreate) -> User:
+    def _row_values(self, obj_in: UserCreate, hashed_password: Optional[str] = None) -> Dict[str, Any]:
         from app.utils.id_generator import generate_compact_id
         from app.models.user import UserRole
         
@@ -30,9 +30,9 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             
         compact_id = generate_compact_id(prefix)
         
-        db_obj = User(
+        return dict(
             email=obj_in.email,
-            hashed_password=get_password_hash(obj_in.password),
+            hashed_password=hashed_password or get_password_hash(obj_in.password),
             full_name=obj_in.full_name,
             role=obj_in.role.value,
             is_active=obj_in.is_active,
@@ -41,11 +41,38 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             compact_id=compact_id,
             image=obj_in.image
         )
+
+    async def create(self, db: AsyncSession, *, obj_in: UserCreate) -> User:
+        db_obj = User(**self._row_values(obj_in))
         db.add(db_obj)
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
 
+    async def create_if_absent(
+        self, db: AsyncSession, *, obj_in: UserCreate, hashed_password: Optional[str] = None
+    ) -> Optional[User]:
+        """
+        Inserts the user unless the email is already taken, in one atomic statement
+        (INSERT ... ON CONFLICT (email) DO NOTHING RETURNING). Returns None on conflict.
+        A given `hashed_password` is stored as-is instead of hashing `obj_in.password`.
+        """
+        if db.bind.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = (
+            insert(User)
+            .values(**self._row_values(obj_in, hashed_password))
+            .on_conflict_do_nothing(index_elements=["email"])
+            .returning(User)
+        )
+        result = await db.execute(stmt)
+        db_obj = result.scalar_one_or_none()
+        await db.commit()
+        return db_obj
+
     async def authenticate(self, db: AsyncSession, *, email: str, password: str) -> Optional[User]:
         user = await self.get_by_email(db, email=email)
         if not user:
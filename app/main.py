@@ -12,9 +12,11 @@ from app.models import specialization, user
 from sqlalchemy import select
 from app.core.database import SessionLocal
 
-from app.agent.LLM.llm import get_vqa_chain, get_medasr_chain, get_siglip_model, get_hear_model
+from app.agent.LLM.llm import get_vqa_chain, get_medasr_chain, get_siglip_model, get_skin_chain, get_hear_model
+from app.utils.http_client import close_http_client
 from fastapi import BackgroundTasks
 from app.utils.wake_up import wake_up_huggingface
+from app.agent.ExpAgent import warm_up_expert_agent
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -33,11 +35,19 @@ async def lifespan(app: FastAPI):
         get_vqa_chain()
         get_medasr_chain()
         get_siglip_model()
+        get_skin_chain()
         get_hear_model()
         logger.info("AI Agent Clients initialized.")
     except Exception as e:
         logger.warning(f"Failed to initialize AI clients: {e}")
 
+    # Pre-warm Pinecone index + Gemini connection for the Expert agent
+    try:
+        await warm_up_expert_agent()
+        logger.info("Expert agent connections warmed.")
+    except Exception as e:
+        logger.warning(f"Failed to warm expert agent: {e}")
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     
@@ -73,6 +83,8 @@ async def lifespan(app: FastAPI):
             agent_process.wait(timeout=5)
         except subprocess.TimeoutExpired:
             agent_process.kill()
+
+    await close_http_client()
     
     # await engine.dispose()
 
@@ -42,4 +42,4 @@ class Appointment(Base):
     doctor = relationship("Doctor")
     nurse = relationship("User", foreign_keys=[nurse_id])
     lab_report = relationship("LabReport", back_populates="appointments")
-    vital_logs = relationship("AppointmentVital", back_populates="appointment")
+    vital_logs = relationship("AppointmentVital", back_populates="appointment", order_by="desc(AppointmentVital.created_at)")
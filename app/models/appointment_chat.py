@@ -1,6 +1,6 @@
 from datetime import datetime
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 
@@ -17,6 +17,11 @@ class AppointmentChat(Base):
     
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # History is fetched per appointment in created_at order; the index serves the sort too
+    __table_args__ = (
+        Index("ix_appointment_chats_appointment_created", "appointment_id", "created_at"),
+    )
+
     # Relationships
     # appointment = relationship("Appointment", back_populates="chats")
     # user = relationship("User", back_populates="chats")
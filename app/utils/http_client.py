@@ -0,0 +1,32 @@
+import httpx
+from typing import Optional
+
+# Shared HTTP/2 client so outbound calls (HF Space agents, file downloads)
+# reuse pooled connections instead of paying a TCP + TLS handshake per request.
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Default for plain file downloads (audio / PDF / images)
+DOWNLOAD_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared pooled httpx.AsyncClient, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # retries=1 re-attempts a failed connect (e.g. a keep-alive socket the far end
+        # dropped); http2/limits live on the transport once one is passed explicitly
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=1,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        )
+        _http_client = httpx.AsyncClient(transport=transport, timeout=120.0)
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Closes the shared client. Called from the app lifespan on shutdown."""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Dict
+from app.utils.cache import TTLCache
+from app.utils.http_client import get_http_client, DOWNLOAD_TIMEOUT
+
+# Images are often re-submitted (retries, summarize + populate on the same upload),
+# so recent downloads are kept in memory. Large files are not cached.
+IMAGE_CACHE_TTL = 600  # seconds
+MAX_CACHED_IMAGE_BYTES = 5 * 1024 * 1024
+_image_cache = TTLCache(maxsize=32, ttl=IMAGE_CACHE_TTL)
+
+# In-flight downloads by URL, so concurrent requests for one image share a GET
+_image_downloads: Dict[str, "asyncio.Task[bytes]"] = {}
+
+
+async def _download_image(url: str) -> bytes:
+    response = await get_http_client().get(url, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    data = response.content
+    if len(data) <= MAX_CACHED_IMAGE_BYTES:
+        _image_cache.set(url, data)
+    return data
+
+
+async def fetch_image(url: str) -> bytes:
+    """Returns the image bytes at `url`, from the cache when it was fetched recently."""
+    data = _image_cache.get(url)
+    if data is not None:
+        return data
+
+    task = _image_downloads.get(url)
+    if task is None:
+        task = asyncio.create_task(_download_image(url))
+        _image_downloads[url] = task
+        task.add_done_callback(lambda _: _image_downloads.pop(url, None))
+    # shield: one caller being cancelled must not abort the download for the others
+    return await asyncio.shield(task)
@@ -1,23 +1,107 @@
 import io
-import httpx
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 from pypdf import PdfReader
 from fastapi import HTTPException
+from app.utils.cache import TTLCache
+from app.utils.http_client import get_http_client, DOWNLOAD_TIMEOUT
 
-async def extract_text_from_pdf_url(url: str) -> str:
+MAX_PDF_BYTES = 25 * 1024 * 1024  # refuse anything larger than 25 MB
+
+# Extracted text by (content hash, max_chars), and each URL's last validators + hash
+_pdf_text_cache = TTLCache(maxsize=64, ttl=3600)
+_pdf_url_cache = TTLCache(maxsize=256, ttl=3600)
+
+# pypdf is pure Python (holds the GIL), so parsing runs in worker processes
+# to keep the event loop free. Created on first use; "spawn" avoids forking
+# a process that already has live threads.
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+
+def _extract_pdf_text(pdf_bytes: bytes, max_chars: Optional[int] = None) -> str:
+    """Parses PDF bytes page by page; stops once `max_chars` of text are collected."""
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    parts = []
+    size = 0
+    for page in reader.pages:
+        page_text = page.extract_text() + "\n"
+        parts.append(page_text)
+        size += len(page_text)
+        if max_chars is not None and size >= max_chars:
+            break
+
+    text = "".join(parts).strip()
+    return text[:max_chars] if max_chars is not None else text
+
+
+async def _download_pdf(url: str, validators: Optional[dict] = None) -> tuple[Optional[bytes], dict]:
+    """
+    Streams the PDF into memory (size-capped).
+    With `validators` (a previous response's ETag / Last-Modified) the GET is conditional;
+    returns (None, validators) when the server answers 304 Not Modified.
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last-modified"):
+            headers["If-Modified-Since"] = validators["last-modified"]
+
+    buf = bytearray()
+    async with get_http_client().stream("GET", url, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 304 and validators:
+            return None, validators
+        response.raise_for_status()
+        declared = response.headers.get("content-length")
+        if declared and int(declared) > MAX_PDF_BYTES:
+            raise ValueError(f"PDF is too large ({int(declared)} bytes, limit {MAX_PDF_BYTES})")
+        async for chunk in response.aiter_bytes(65536):
+            buf.extend(chunk)
+            if len(buf) > MAX_PDF_BYTES:
+                raise ValueError(f"PDF is too large (limit {MAX_PDF_BYTES} bytes)")
+        new_validators = {k: response.headers[k] for k in ("etag", "last-modified") if k in response.headers}
+    return bytes(buf), new_validators
+
+
+async def extract_text_from_pdf_url(url: str, max_chars: Optional[int] = None) -> str:
     """
     Download PDF from URL and extract text using pypdf.
+    Pass `max_chars` when only a prefix is needed; parsing stops early.
+    Extracted text is cached by content hash, and a revisited URL is revalidated with a
+    conditional GET, so re-submitting the same report skips the download and the parse.
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            pdf_bytes = io.BytesIO(response.content)
-            
-        reader = PdfReader(pdf_bytes)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-            
-        return text.strip()
+        known = _pdf_url_cache.get(url)  # (validators, digest)
+        pdf_bytes, validators = await _download_pdf(url, known[0] if known else None)
+
+        if pdf_bytes is None:
+            digest = known[1]
+        else:
+            digest = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+            if validators:
+                _pdf_url_cache.set(url, (validators, digest))
+
+        text = _pdf_text_cache.get((digest, max_chars))
+        if text is not None:
+            return text
+
+        if pdf_bytes is None:
+            # Server says unchanged but the text was evicted; fetch the body again
+            pdf_bytes, _ = await _download_pdf(url)
+
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(_get_pdf_pool(), _extract_pdf_text, pdf_bytes, max_chars)
+        _pdf_text_cache.set((digest, max_chars), text)
+        return text
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to extract text from PDF: {str(e)}")
@@ -0,0 +1,226 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterable, AsyncIterator, Optional, Union
+
+import orjson
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(payload: dict) -> bytes:
+    """
+    Encode a payload as a Server-Sent Events `data:` frame.
+    Uses orjson (bytes out) so streams skip the str -> bytes re-encode.
+    """
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+_TOKEN_PREFIX = b'data: {"type":"token","content":'
+_TOKEN_SUFFIX = b"}\n\n"
+
+
+def sse_token(content: str) -> bytes:
+    """
+    Fast path for `sse_event({"type": "token", "content": content})`.
+    The envelope is constant, so only the token string itself is encoded.
+    """
+    return _TOKEN_PREFIX + orjson.dumps(content) + _TOKEN_SUFFIX
+
+
+async def batch_tokens(chunks: AsyncIterable[str], max_delay: float = 0.025, max_chars: int = 16384):
+    """
+    Coalesces a stream of text chunks into SSE token frames.
+    A frame goes out `max_delay` seconds after its first chunk arrived, or as soon as it
+    holds `max_chars` of text, so fast bursts share one frame without holding back a slow tail.
+    Buffered text is flushed before an upstream error is re-raised.
+    """
+    loop = asyncio.get_running_loop()
+    it = aiter(chunks)
+    buf = []
+    size = 0
+    deadline = 0.0
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(it))
+            timeout = max(deadline - loop.time(), 0) if buf else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield sse_token("".join(buf))
+                buf.clear()
+                size = 0
+                continue
+
+            task, pending = pending, None
+            try:
+                text = task.result()
+            except StopAsyncIteration:
+                break
+            if not text:
+                continue
+            if not buf:
+                deadline = loop.time() + max_delay
+            buf.append(text)
+            size += len(text)
+            if size >= max_chars:
+                yield sse_token("".join(buf))
+                buf.clear()
+                size = 0
+    except Exception:
+        if buf:
+            yield sse_token("".join(buf))
+            buf.clear()
+        raise
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if buf:
+        yield sse_token("".join(buf))
+
+
+_STREAM_END = object()
+_STREAM_OVERFLOW = object()
+
+# SSE comment line: ignored by EventSource, but keeps idle proxies from closing the stream
+SSE_HEARTBEAT = b":hb\n\n"
+
+
+async def bounded_sse(
+    stream: AsyncIterator[Union[bytes, str]],
+    max_frames: int = 512,
+    max_bytes: int = 4 * 1024 * 1024,
+    put_timeout: float = 30.0,
+    heartbeat: float = 15.0,
+):
+    """
+    Runs an SSE generator ahead of the client through a bounded buffer.
+    The producer blocks once `max_frames` frames or `max_bytes` bytes are waiting, which
+    pushes back on the upstream model stream. If the client hasn't drained any room for
+    `put_timeout` seconds, the buffered frames are dropped, a `stream_overflow` event is
+    sent and the stream ends.
+    While the producer is silent (e.g. a long model call), a heartbeat comment goes out
+    every `heartbeat` seconds.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_frames)
+    room = asyncio.Event()
+    buffered = 0
+    error: Optional[BaseException] = None
+
+    async def put(frame: bytes):
+        while buffered and buffered + len(frame) > max_bytes:
+            room.clear()
+            await room.wait()
+        await queue.put(frame)
+
+    async def produce():
+        nonlocal buffered, error
+        try:
+            async with aclosing(stream):
+                async for frame in stream:
+                    if isinstance(frame, str):
+                        frame = frame.encode()
+                    # Only the wait for room counts as overflow; a TimeoutError raised
+                    # by the upstream generator itself takes the normal error path
+                    try:
+                        await asyncio.wait_for(put(frame), put_timeout)
+                    except TimeoutError:
+                        while not queue.empty():
+                            queue.get_nowait()
+                        queue.put_nowait(_STREAM_OVERFLOW)
+                        return
+                    buffered += len(frame)
+        except Exception as e:
+            error = e
+        await queue.put(_STREAM_END)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            try:
+                async with asyncio.timeout(heartbeat):
+                    item = await queue.get()
+            except TimeoutError:
+                yield SSE_HEARTBEAT
+                continue
+            if item is _STREAM_END:
+                if error is not None:
+                    raise error
+                return
+            if item is _STREAM_OVERFLOW:
+                yield sse_event({'type': 'stream_overflow'})
+                return
+            buffered -= len(item)
+            room.set()
+            yield item
+    finally:
+        producer.cancel()
+
+
+async def coalesce_partials(frames: AsyncIterable[Union[bytes, str]], interval: float = 0.02):
+    """
+    Drop-latest view of an SSE stream for clients that only render the newest text.
+    Token frames are folded into the response so far; at most every `interval`
+    seconds one `{"type": "partial", "content": <full text so far>}` frame goes out,
+    so intermediate states the client would immediately overwrite are never sent.
+    Other frames pass through unchanged, after any pending partial.
+    """
+    loop = asyncio.get_running_loop()
+    it = aiter(frames)
+    parts = []
+    dirty = False
+    deadline = 0.0
+    pending = None
+
+    def partial() -> bytes:
+        return sse_event({'type': 'partial', 'content': "".join(parts)})
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(it))
+            timeout = max(deadline - loop.time(), 0) if dirty else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield partial()
+                dirty = False
+                continue
+
+            task, pending = pending, None
+            try:
+                frame = task.result()
+            except StopAsyncIteration:
+                break
+            if isinstance(frame, str):
+                frame = frame.encode()
+            if frame.startswith(_TOKEN_PREFIX):
+                parts.append(orjson.loads(frame[6:])["content"])
+                if not dirty:
+                    dirty = True
+                    deadline = loop.time() + interval
+                continue
+            if dirty:
+                yield partial()
+                dirty = False
+            yield frame
+    except Exception:
+        if dirty:
+            yield partial()
+            dirty = False
+        raise
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if dirty:
+        yield partial()
+
+
+# Stop reverse proxies (nginx, Cloudflare) from buffering or caching the stream,
+# which would hold tokens back until a multi-KB boundary
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_response(stream: AsyncIterator[Union[bytes, str]]) -> StreamingResponse:
+    """StreamingResponse for an SSE generator: bounded buffer plus no-buffering headers."""
+    return StreamingResponse(bounded_sse(stream), media_type="text/event-stream", headers=SSE_HEADERS)
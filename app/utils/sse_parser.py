@@ -0,0 +1,70 @@
+from typing import List, NamedTuple, Optional, Union
+
+MAX_SSE_BUFFER = 4 * 1024 * 1024  # an unterminated event larger than this is an error
+
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: str
+    id: Optional[str] = None
+
+
+class SSEParser:
+    """
+    Incremental parser for an upstream text/event-stream body.
+    Network chunks don't line up with events: one chunk can hold several `data:` records
+    and one record can span chunks. `feed` buffers bytes and returns every event
+    completed so far; events are decoded whole, so multi-byte characters never split.
+    """
+
+    def __init__(self, max_buffer: int = MAX_SSE_BUFFER):
+        self.max_buffer = max_buffer
+        self._buf = bytearray()
+        self._pending_cr = False
+
+    def feed(self, chunk: Union[bytes, str]) -> List[SSEEvent]:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # CR, LF and CRLF all end a line; hold back a trailing CR in case its LF is next
+        if self._pending_cr:
+            chunk = b"\r" + chunk
+        self._pending_cr = chunk.endswith(b"\r")
+        if self._pending_cr:
+            chunk = chunk[:-1]
+        chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        search = max(len(self._buf) - 1, 0)
+        self._buf += chunk
+        events = []
+        pos = 0
+        while (end := self._buf.find(b"\n\n", search)) != -1:
+            event = self._parse_block(bytes(self._buf[pos:end]))
+            if event is not None:
+                events.append(event)
+            pos = search = end + 2
+        del self._buf[:pos]
+
+        if len(self._buf) > self.max_buffer:
+            raise ValueError(f"SSE event exceeds {self.max_buffer} bytes")
+        return events
+
+    @staticmethod
+    def _parse_block(block: bytes) -> Optional[SSEEvent]:
+        event = "message"
+        event_id = None
+        data = []
+        for line in block.decode("utf-8", errors="replace").split("\n"):
+            if not line or line.startswith(":"):
+                continue
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if field == "data":
+                data.append(value)
+            elif field == "event":
+                event = value
+            elif field == "id":
+                event_id = value
+        if not data:
+            return None
+        return SSEEvent(event=event, data="\n".join(data), id=event_id)
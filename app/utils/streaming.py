@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Callable
+
+_SENTINEL = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+async def aiter_in_thread(fn: Callable[..., Any], *args, maxsize: int = 32, **kwargs) -> AsyncIterator[Any]:
+    """
+    Call a blocking function that returns a sync iterator (e.g. a Gemini
+    `generate_content_stream`) and iterate it on a worker thread, handing items
+    to the event loop through a bounded queue. The loop stays free between
+    items; a slow consumer applies backpressure to the producer thread.
+    Exceptions raised by `fn` or the iterator are re-raised to the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        try:
+            for item in fn(*args, **kwargs):
+                if stopped.is_set():
+                    return
+                put(item)
+        except BaseException as e:
+            if not stopped.is_set():
+                put(_Failure(e))
+            return
+        if not stopped.is_set():
+            put(_SENTINEL)
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _SENTINEL:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stopped.set()
+        # Unblock a producer waiting on a full queue so its thread can exit
+        while not queue.empty():
+            queue.get_nowait()
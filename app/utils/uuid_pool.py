@@ -0,0 +1,20 @@
+import os
+import uuid
+from typing import List
+
+# Random bytes are drawn for POOL_SIZE ids at a time, one getrandom call per refill
+# instead of one per uuid4()
+POOL_SIZE = 1024
+_pool: List[str] = []
+
+
+def _refill() -> None:
+    raw = os.urandom(16 * POOL_SIZE)
+    _pool.extend(str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, len(raw), 16))
+
+
+def new_uuid() -> str:
+    """Random (version 4) UUID string from the pool. Safe on the event loop."""
+    if not _pool:
+        _refill()
+    return _pool.pop()
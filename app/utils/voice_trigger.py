@@ -1,8 +1,11 @@
+import asyncio
 import logging
 import os
+from typing import Dict
 from dotenv import load_dotenv
 from livekit import api
 from app.core.config import settings
+from app.utils.cache import TTLCache
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -79,3 +82,39 @@ async def trigger_call(phone_number: str, appointment_id: str = None, doctor_pro
         raise e
     finally:
         await lkapi.aclose()
+
+
+# A double-tapped or retried /trigger-call within this window must not dial twice
+CALL_DEDUP_TTL = 10  # seconds
+_recent_calls = TTLCache(maxsize=4096, ttl=CALL_DEDUP_TTL)
+_calls_in_flight: Dict[tuple, "asyncio.Task[None]"] = {}
+
+
+async def trigger_call_once(user_id: str, phone_number: str, appointment_id: str = None, doctor_prompt: str = None) -> bool:
+    """
+    trigger_call, deduplicated per (user, phone number, appointment).
+    A request arriving while the same call is being set up waits for that attempt,
+    and one arriving within CALL_DEDUP_TTL of a successful call is dropped.
+    Returns True if this request placed the call. Failed attempts are not remembered.
+    """
+    key = (user_id, phone_number, appointment_id)
+    if _recent_calls.get(key):
+        return False
+
+    task = _calls_in_flight.get(key)
+    if task is not None:
+        await asyncio.shield(task)
+        return False
+
+    task = asyncio.create_task(trigger_call(phone_number, appointment_id, doctor_prompt))
+    _calls_in_flight[key] = task
+
+    def _finished(t: "asyncio.Task[None]") -> None:
+        _calls_in_flight.pop(key, None)
+        if not t.cancelled() and t.exception() is None:
+            _recent_calls.set(key, True)
+
+    task.add_done_callback(_finished)
+    # shield: a client disconnecting mid-setup must not abort a call already being dialed
+    await asyncio.shield(task)
+    return True
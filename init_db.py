@@ -54,6 +54,15 @@ async def init_db():
             except Exception:
                 pass 
 
+            # Chat history is read by appointment, oldest first
+            try:
+                await conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_appointment_chats_appointment_created "
+                    "ON appointment_chats (appointment_id, created_at)"
+                ))
+            except Exception:
+                pass
+
             await conn.commit()
         except Exception as e:
             print(f"Schema update check completed with minor warnings: {e}")